@@ -0,0 +1,202 @@
+'''
+    Benchmark scenes: measures the average time it takes to update and to render a frame of a few spaces,
+    the memory taken by each body (measured with tracemalloc), the error of the float32 physics and the
+    throughput of the force computation (in pair interactions per second) of each engine.\n
+    The repository has no test suite, so this is also where the float32 accuracy is checked: the run fails if the
+    error of the float32 accelerations is above FLOAT32_MAX_ACC_ERROR.\n
+    Usage: python benchmark.py [frames] [bodies for the memory measurement]\n
+    The SDL dummy video driver is used unless SDL_VIDEODRIVER is set, so no window is opened.
+'''
+import os
+import sys
+import time
+import tracemalloc
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+import physics
+from physics import get_accelerations
+from space import *
+from display import Display
+
+W, H = 800, 600
+FLOAT32_MAX_ACC_ERROR = 1e-4 # relative error of the float32 accelerations, from 5e-6 to 2e-5 with random_scene(200)
+
+def solar_system_scene(renders_field=True, field_mode='arrows') -> Space:
+    space = Space(W=W, H=H)
+    space.load('Solar Sys')
+    space.renders_field = renders_field
+    space.field_mode = field_mode
+    return space
+
+def ring_scene(num_particles: int) -> Space:
+    '''
+        Returns the solar system with a ring of num_particles test particles (see particles.py) around its star
+    '''
+    space = solar_system_scene()
+    star = max(space.bodies, key=lambda body: body.mass)
+    space.add_ring(star, 3*star.radius, 12*star.radius, num_particles, seed=0)
+    return space
+
+def random_scene(num_bodies: int, seed=0) -> Space:
+    '''
+        Returns a space with num_bodies bodies with random positions, masses and velocities
+    '''
+    rng = np.random.default_rng(seed)
+    bodies = []
+    for i in range(num_bodies):
+        body = Body(rng.uniform((0,0), (W,H)), 10**rng.uniform(-2, 3), name=f"Body {i}")
+        body.set_vel(rng.normal(0, 1, 2))
+        bodies.append(body)
+    return Space(bodies, W=W, H=H)
+
+def disk_scene(num_bodies: int, seed=0) -> Space:
+    '''
+        Returns a space with a star and num_bodies bodies on circular orbits around it, heavy enough for every body
+        to attract the others (see Space.light_mass_ratio)
+    '''
+    rng = np.random.default_rng(seed)
+    star = Body((W/2,H/2), 333000, name="Star")
+    bodies = [star]
+    for i in range(num_bodies):
+        dist, angle = rng.uniform(50, 250), rng.uniform(0, 2*np.pi)
+        offset = np.array((np.cos(angle), np.sin(angle)))
+        body = Body(star.pos+offset*dist, 10**rng.uniform(0.6, 1), name=f"Body {i}")
+        body.set_vel(np.array((offset[1], -offset[0]))*np.sqrt(Body.G_SIM*star.mass/dist))
+        bodies.append(body)
+    return Space(bodies, W=W, H=H)
+
+def twin_scene(num_bodies: int, clustered=True) -> Space:
+    '''
+        Returns a space with two disk scenes of num_bodies/2 bodies each, far enough from each other to be stepped
+        as separate clusters (see clusters.py) if clustered is True
+    '''
+    first, second = disk_scene(num_bodies//2, seed=0), disk_scene(num_bodies//2, seed=1)
+    for body in second.bodies:
+        body.pos[0] += 4*W
+    space = Space(first.bodies+second.bodies, W=W, H=H)
+    if clustered:
+        space.clusters = ClusterStepper()
+    return space
+
+SCENES = {
+    'solar system': solar_system_scene,
+    'no field': lambda: solar_system_scene(renders_field=False),
+    'adaptive field': lambda: solar_system_scene(field_mode='adaptive'),
+    'heatmap': lambda: solar_system_scene(field_mode='potential'),
+    'random 50': lambda: random_scene(50),
+    'random 200': lambda: random_scene(200),
+    'ring 50000': lambda: ring_scene(50000),
+    'twin 2000': lambda: twin_scene(2000),
+    'twin 2000 joined': lambda: twin_scene(2000, clustered=False),
+}
+
+def bench_scene(space: Space, win: Display, surf: pygame.Surface, frames=30) -> tuple:
+    '''
+        Returns the average time (in milliseconds) taken by an update and by the rendering of a frame
+    '''
+    update_time, render_time = 0, 0
+    space.update() # one-time costs (like compiling the numba kernel) aren't measured
+    for _ in range(frames):
+        start = time.perf_counter()
+        space.update()
+        update_time += time.perf_counter()-start
+
+        start = time.perf_counter()
+        surf.fill((0,0,0))
+        space.render(surf, W, H)
+        win.render(surf)
+        render_time += time.perf_counter()-start
+    return update_time/frames*1000, render_time/frames*1000
+
+def measure_body_memory(num_bodies=100000) -> float:
+    '''
+        Returns the memory (in bytes) allocated for each body of a headless scene with num_bodies bodies, the
+        textures are allocated by SDL so tracemalloc doesn't see them (they're shared by size anyway)
+    '''
+    rng = np.random.default_rng(0)
+    pos, mass = rng.uniform((0,0), (W,H), (num_bodies,2)), 10**rng.uniform(-2, 3, num_bodies)
+    tracemalloc.start()
+    bodies = [Body(pos[i], float(mass[i])) for i in range(num_bodies)]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del bodies
+    return allocated/num_bodies
+
+def measure_float32_error(num_bodies=200, steps=100) -> tuple:
+    '''
+        Returns the maximum relative error of the accelerations computed with float32 (compared to float64),
+        and the maximum distance (in pixels) between the positions of the bodies after the given amount of steps
+    '''
+    space64, space32 = random_scene(num_bodies), random_scene(num_bodies)
+    space32.dtype = np.float32
+    pos, _, mass = space64.get_state()
+    acc64 = get_accelerations(pos, mass, np.float64)
+    acc32 = get_accelerations(pos, mass, np.float32)
+    acc_error = np.max(np.linalg.norm(acc32-acc64, axis=1)/np.linalg.norm(acc64, axis=1))
+    for _ in range(steps):
+        space64.update()
+        space32.update()
+    pos_error = np.max(np.linalg.norm(space32.get_state()[0]-space64.get_state()[0], axis=1))
+    return acc_error, pos_error
+
+def measure_integrator_error(integrator: str, tick_time: float, days=360) -> float:
+    '''
+        Returns the largest distance (in pixels) between the positions of the bodies of the solar system after the
+        given amount of days stepped with the integrator (see kepler.INTEGRATORS) and tick_time, and the ones
+        stepped with the wisdom-holman integrator and a tiny tick_time. Every body attracts the others (the
+        light ones would just follow kepler orbits, which the wisdom-holman integrator solves exactly)
+    '''
+    steps = round(days/tick_time)
+    positions = []
+    for integrator, tick_time, steps in ((integrator, tick_time, steps), ('wisdom-holman', steps*tick_time/(20*days), 20*days)):
+        space = solar_system_scene()
+        space.integrator, space.tick_time, space.light_mass_ratio = integrator, tick_time, 0
+        for _ in range(steps):
+            space.update()
+        positions.append(space.get_state()[0])
+    return np.max(np.linalg.norm(positions[0]-positions[1], axis=1))
+
+def measure_force_throughput(num_bodies: int, engine: str, repeats=3) -> float:
+    '''
+        Returns the number of pair interactions per second computed by get_accelerations() with the given engine
+        (see physics.ENGINE), the first call isn't measured so that the numba kernel is already compiled
+    '''
+    pos, _, mass = random_scene(num_bodies).get_state()
+    old_engine, physics.ENGINE = physics.ENGINE, engine
+    get_accelerations(pos, mass)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        get_accelerations(pos, mass)
+    elapsed = (time.perf_counter()-start)/repeats
+    physics.ENGINE = old_engine
+    return num_bodies*(num_bodies-1)/elapsed
+
+def main(frames=30, memory_bodies=100000) -> None:
+    pygame.init()
+    win = Display(W, H)
+    win.create("Benchmark", load_texture("logo.png"))
+    win.set_brightness(200) # make sure the brightness is applied as well
+    surf = win.create_buffer()
+    for name, scene in SCENES.items():
+        update_ms, render_ms = bench_scene(scene(), win, surf, frames)
+        print(f"{name:>16}: update {update_ms:8.2f} ms, render {render_ms:8.2f} ms")
+    print(f"{'memory':>16}: {measure_body_memory(memory_bodies):.0f} bytes/body ({memory_bodies} bodies)")
+    for name in ('solar system', 'random 200'):
+        heavy_error, light_error = SCENES[name]().get_partition_error()
+        print(f"{'partition':>16}: {name}, error on the heavy bodies {heavy_error:.2e}, on the light ones {light_error:.2e}")
+    acc_error, pos_error = measure_float32_error()
+    print(f"{'float32':>16}: acceleration error {acc_error:.2e}, position error after 100 steps {pos_error:.2e} px")
+    assert acc_error <= FLOAT32_MAX_ACC_ERROR, f"the float32 acceleration error is above {FLOAT32_MAX_ACC_ERROR:.0e}"
+    for integrator, tick_time in (('euler', 1), ('euler', 0.1), ('wisdom-holman', 1), ('wisdom-holman', 10)):
+        error = measure_integrator_error(integrator, tick_time)
+        print(f"{integrator:>16}: position error after 360 days with a tick time of {tick_time} days {error:.2e} px")
+    for engine in ('numpy', 'numba'):
+        if engine == 'numba' and physics.get_jit_kernel() is None:
+            continue
+        for num_bodies in (1000, 5000):
+            throughput = measure_force_throughput(num_bodies, engine)
+            print(f"{engine+' '+str(num_bodies):>16}: {throughput:.3g} pair interactions/s")
+    pygame.quit()
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
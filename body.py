@@ -7,32 +7,106 @@ class BodyType(Enum):
     STAR = 1,
     EARTH = 2
 
+class BodyStore:
+    '''
+        Shared storage of the positions and velocities of the bodies, every body owns a row (x, y, vx, vy) in one of
+        the chunks. The chunks are never reallocated, so a view of a row (like body.pos) stays valid as long as its
+        body exists
+    '''
+    CHUNK_SIZE = 1 << 16 # rows in each chunk
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.free_rows = [] # rows of the bodies that have been deleted, they're reused first
+        self.next_row = 0
+
+    def allocate(self) -> int:
+        ''' Returns a free row '''
+        if len(self.free_rows) != 0:
+            return self.free_rows.pop()
+        if self.next_row == len(self.chunks)*self.CHUNK_SIZE:
+            self.chunks.append(np.zeros((self.CHUNK_SIZE, 4), dtype=np.float64))
+        self.next_row += 1
+        return self.next_row-1
+
+    def release(self, row: int) -> None:
+        self.free_rows.append(row)
+
+    def get_row(self, row: int) -> np.ndarray:
+        return self.chunks[row // self.CHUNK_SIZE][row % self.CHUNK_SIZE]
+
+    def gather(self, rows: np.ndarray) -> np.ndarray:
+        ''' Returns a (N,4) array with the given rows '''
+        chunk_idx, offsets = np.divmod(rows, self.CHUNK_SIZE)
+        if len(self.chunks) == 1 or len(rows) == 0:
+            return self.chunks[0][offsets] if len(rows) != 0 else np.zeros((0,4))
+        values = np.empty((len(rows), 4), dtype=np.float64)
+        for chunk in np.unique(chunk_idx):
+            in_chunk = chunk_idx == chunk
+            values[in_chunk] = self.chunks[chunk][offsets[in_chunk]]
+        return values
+
+    def scatter(self, rows: np.ndarray, values: np.ndarray) -> None:
+        ''' Writes the (N,4) values in the given rows '''
+        chunk_idx, offsets = np.divmod(rows, self.CHUNK_SIZE)
+        if len(self.chunks) == 1:
+            self.chunks[0][offsets] = values
+            return
+        for chunk in np.unique(chunk_idx):
+            in_chunk = chunk_idx == chunk
+            self.chunks[chunk][offsets[in_chunk]] = values[in_chunk]
+
 # mass = 1 -> the mass of the body is the mass of the eart (5.972 x 10^24 Kg)
 # with 1 pix = 10^6 km
 # G is normally 10**-11 m^3/(Kg*s^2) = 10^-20 km^3/(Kg*s^2) = 10^-14 pix/(Kg*s^2)
 class Body:
     G = 6.7408e-20
     EARTH_MASS = 5.9722e24
+    KM_PER_PIXEL = 1e6
+    SECONDS_PER_DAY = 86400
+    # G in the units of the simulation: pixels^3/(earth masses*days^2), so that a = G_SIM*mass/dist^2
+    # with the mass in earth masses and the distance in pixels gives the acceleration in pixels/day^2
+    G_SIM = G*EARTH_MASS*SECONDS_PER_DAY**2/KM_PER_PIXEL**3
     COLOR = (153,102,0)
     RADIUS_HIGHLIGHT_MULTIPLIER = 1.1
-    TEXTURES = load_spritesheet('bodies.png', tile_w=128, tile_h=128)
+    TEXTURES = 'bodies.png' # spritesheet with a 128x128 texture for each type of body
+    STORE = BodyStore() # the positions and the velocities of every body
+    _textures = {} # (type, radius) -> scaled texture, shared by every body with that type and radius
+
+    # the weakref is needed by the checkpoints (see checkpoints.py)
+    __slots__ = ('row', 'mass', 'name', '_type', 'highlighted', 'radius', 'texture', '__weakref__')
 
     def __init__(self, pos: tuple, mass: float, name="Body", _type=BodyType.PLANET) -> None:
-        if not isinstance(pos, np.ndarray):
-            pos = np.array(pos, dtype=np.float64)
+        self.row = Body.STORE.allocate() # the row of the body in STORE
         self.pos = pos
+        self.vel = (0,0)
         self.mass = mass
-        self.vel = np.zeros((2,), dtype=np.float64)
         self.name = name
         self._type = _type
         self.highlighted = False
+        self.radius = None
         self.set_radius(max(np.log(self.mass*20+1),1))
 
-    def update(self, time_step: float) -> None:
-        '''
-            Updates the body's position to the one after time_step days have passed
-        '''
-        self.pos += self.vel*time_step
+    def __del__(self) -> None:
+        self.STORE.release(self.row)
+
+    @property
+    def pos(self) -> np.ndarray:
+        ''' The position of the body, it's a view of its row in STORE so it can be modified in place '''
+        return Body.STORE.get_row(self.row)[:2]
+
+    @pos.setter
+    def pos(self, pos) -> None:
+        Body.STORE.get_row(self.row)[:2] = pos
+
+    @property
+    def vel(self) -> np.ndarray:
+        ''' The velocity of the body, it's a view of its row in STORE so it can be modified in place '''
+        return Body.STORE.get_row(self.row)[2:]
+
+    @vel.setter
+    def vel(self, vel) -> None:
+        Body.STORE.get_row(self.row)[2:] = vel
 
     def render(self, surf: pygame.Surface) -> None:
         '''
@@ -48,7 +122,7 @@ class Body:
             Renders the velocity vector of the body in its position
         '''
         if self.get_abs_vel() != 0:
-            draw_vector(surf, self.vel, np.log(self.get_abs_vel()*1e-2+1), self.pos)
+            ARROW_ATLAS.draw(surf, self.vel, np.log(self.get_abs_vel()*1e-2+1), self.pos)
 
     def get_dist(self, pos: tuple) -> float:
         '''
@@ -61,34 +135,24 @@ class Body:
         if change_radius:
             self.set_radius(max(np.log(self.mass*20+1),1))
 
-    def gravitate(self, other, time_step):
-        '''
-            Apply the correct acceleration to move towards the body other
-        '''
-        # the mass of the other object has to be converted to kilograms
-        acc = self.G*(other.mass*self.EARTH_MASS)/((self.get_dist(other.pos)*1e6)**3)
-        acc = acc*(other.pos-self.pos)*(86400)**2*time_step
-        self.vel += acc
-
-    def get_grav_pull(self, pos: np.ndarray, time_step):
-        '''
-            Returns the gravitational field vector given by the attraction from this body in the
-            given position over time_step amount of days
-        '''
-        if np.array_equal(self.pos, pos):
-            return np.zeros(2)
-
-        # the mass of the other object has to be converted to kilograms
-        acc = self.G*(self.mass*self.EARTH_MASS)/((self.get_dist(pos)*1e6)**3)
-        acc = acc*(self.pos-pos)*(86400)**2*time_step
-        return acc
-
     def set_radius(self, radius: float) -> None:
-        if 'radius' in dir(self) and round(radius) == self.radius: # this prevents a continuous resizing of the texture (computationally expensive)
+        if self.radius is not None and round(radius) == self.radius:
             return
         
         self.radius = round(radius)
-        self.texture = pygame.transform.scale(Body.TEXTURES[self._type.value[0]], (self.radius*2, self.radius*2))
+        self.texture = Body.get_texture(self._type, self.radius)
+
+    @staticmethod
+    def get_texture(_type: BodyType, radius: int) -> pygame.Surface:
+        '''
+            Returns the texture of the bodies with the given type and radius, it's shared by all of them
+            so it shouldn't be modified
+        '''
+        texture = Body._textures.get((_type, radius))
+        if texture is None: # scaling the texture is expensive, so it's only done once for each size
+            texture = pygame.transform.scale(load_spritesheet(Body.TEXTURES, tile_w=128, tile_h=128)[_type.value[0]], (radius*2, radius*2))
+            Body._textures[(_type, radius)] = texture
+        return texture
 
     def get_abs_vel(self) -> float:
         '''
@@ -182,8 +246,22 @@ class Body:
             Returns the body represented as a string, this is used when saving the body (along with the space its in),
             the body can also be loaded back based on the string
         '''
-        body_repr = f"BODY\nname:{self.name}\nmass:{self.mass}\npos:{tuple(self.pos)}\n"
-        body_repr += f"vel:{tuple(self.vel)}\nradius:{self.radius}\n"
+        return Body.format_representation(*self.get_save_state())
+
+    def get_save_state(self) -> tuple:
+        '''
+            Returns a copy of the properties of the body that are saved, as (name, mass, pos, vel, radius)
+        '''
+        return (self.name, self.mass, (float(self.pos[0]), float(self.pos[1])),
+                (float(self.vel[0]), float(self.vel[1])), self.radius)
+
+    @staticmethod
+    def format_representation(name, mass, pos, vel, radius) -> str:
+        '''
+            Returns the string representation of a body with the given properties (see get_str_representation())
+        '''
+        body_repr = f"BODY\nname:{name}\nmass:{mass}\npos:{pos}\n"
+        body_repr += f"vel:{vel}\nradius:{radius}\n"
         return body_repr
 
     def load_from_representation(self, representation: str) -> str:
@@ -196,4 +274,4 @@ class Body:
         self.mass = float(properties['mass'])
         self.pos = np.array(properties['pos'].replace('(','').replace(')','').split(', '), dtype=np.float64)
         self.vel = np.array(properties['vel'].replace('(','').replace(')','').split(', '), dtype=np.float64)
-        self.set_radius(properties['radius'])
\ No newline at end of file
+        self.set_radius(float(properties['radius']))
\ No newline at end of file
@@ -0,0 +1,193 @@
+import io
+import os
+import struct
+import zlib
+import weakref
+import numpy as np
+from body import Body
+
+class CheckpointStore:
+    '''
+        Append-only log of checkpoints of a space, meant for long runs.\n
+        The first checkpoint is a full snapshot of the space (a base), the following ones (deltas) only store what
+        changed since the previous one: the bits of the positions, velocities, masses and radii are XORed with the
+        previous ones, so the values that didn't change (or only changed a little) compress to almost nothing.
+        compact() replaces the whole log with a single base.
+    '''
+    BASE, DELTA = b'B', b'D'
+    HEADER = struct.Struct('<cdI') # kind of checkpoint, days passed in the space, length of the payload
+    FIELDS = ('pos', 'vel', 'mass', 'radius') # the arrays stored as XOR deltas
+
+    def __init__(self, file_path: str, compress_level=1) -> None:
+        '''
+            file_path -> the file of the log, if it already exists new checkpoints are appended to it\n
+            compress_level -> zlib compression level of each checkpoint
+        '''
+        self.file_path = file_path
+        self.compress_level = compress_level
+        self.records = [] # (offset in the file, kind, days passed) of each checkpoint
+        self.body_ids = weakref.WeakKeyDictionary() # body -> its id in the checkpoints
+        self.next_id = 0
+        self.last = None # the state saved by the last checkpoint, the next delta is based on it
+        if os.path.exists(file_path):
+            self._read_records()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def checkpoint(self, space) -> int:
+        '''
+            Appends a checkpoint of the given space to the log and returns its index
+        '''
+        state = self._get_state(space)
+        if self.last is None:
+            kind, arrays = self.BASE, state
+        else:
+            kind, arrays = self.DELTA, self._get_delta(self.last, state)
+        payload = self._pack(arrays)
+        with open(self.file_path, 'ab') as file:
+            offset = file.tell()
+            file.write(self.HEADER.pack(kind, float(state['time_passed']), len(payload)))
+            file.write(payload)
+        self.records.append((offset, kind, float(state['time_passed'])))
+        self.last = state
+        return len(self.records)-1
+
+    def restore(self, space, index=-1) -> None:
+        '''
+            Restores the space to the checkpoint with the given index (by default the last one), the
+            bodies of the space are replaced by new ones
+        '''
+        state = self.get_state(index)
+        space.bodies = []
+        for idx in range(len(state['ids'])):
+            body = Body(state['pos'][idx], float(state['mass'][idx]), name=str(state['names'][idx]))
+            body.set_vel(state['vel'][idx])
+            body.set_radius(int(state['radius'][idx]))
+            self.body_ids[body] = int(state['ids'][idx])
+            space.bodies.append(body)
+        if len(state['ids']) != 0: # the bodies added from now on mustn't take the id of a restored one
+            self.next_id = max(self.next_id, int(state['ids'].max())+1)
+        space.tick_time = float(state['tick_time'])
+        space.time_passed = float(state['time_passed'])
+        if space.worker is not None:
+            space.worker.send_bodies()
+        # the next checkpoint can't be a delta of the last one in the log anymore
+        self.last = None
+
+    def get_state(self, index=-1) -> dict:
+        '''
+            Returns the arrays with the state of the space at the checkpoint with the given index
+        '''
+        index = range(len(self.records))[index]
+        base = index
+        while self.records[base][1] != self.BASE:
+            base -= 1
+        with open(self.file_path, 'rb') as file:
+            state = self._read_payload(file, base)
+            for idx in range(base+1, index+1):
+                state = self._apply_delta(state, self._read_payload(file, idx))
+        return state
+
+    def compact(self) -> None:
+        '''
+            Replaces the log with a single base with the state of the last checkpoint, the older checkpoints are lost
+        '''
+        if len(self.records) == 0:
+            return
+        state = self.get_state()
+        payload = self._pack(state)
+        with open(self.file_path+'.tmp', 'wb') as file:
+            file.write(self.HEADER.pack(self.BASE, float(state['time_passed']), len(payload)))
+            file.write(payload)
+        os.replace(self.file_path+'.tmp', self.file_path)
+        self.records = [(0, self.BASE, float(state['time_passed']))]
+        self.last = state
+
+    def _get_state(self, space) -> dict:
+        for body in space.bodies:
+            if body not in self.body_ids:
+                self.body_ids[body] = self.next_id
+                self.next_id += 1
+        pos, vel, mass = space.get_state()
+        return {
+            'ids': np.array([self.body_ids[body] for body in space.bodies], dtype=np.int64),
+            'names': np.array([body.name for body in space.bodies], dtype=str),
+            'pos': pos, 'vel': vel, 'mass': mass,
+            'radius': np.array([body.radius for body in space.bodies], dtype=np.int64),
+            'tick_time': np.float64(space.tick_time), 'time_passed': np.float64(space.time_passed)
+        }
+
+    @staticmethod
+    def _align(prev_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        '''
+            Returns the index in prev_ids of each of the ids, -1 for the ones that aren't in it
+        '''
+        if len(prev_ids) == 0:
+            return np.full(len(ids), -1)
+        order = np.argsort(prev_ids)
+        found = np.clip(np.searchsorted(prev_ids[order], ids), 0, len(prev_ids)-1)
+        return np.where(prev_ids[order][found] == ids, order[found], -1)
+
+    @staticmethod
+    def _get_aligned(prev: dict, field: str, prev_idx: np.ndarray, shape) -> np.ndarray:
+        ''' Returns the values of the field in prev in the order given by prev_idx (zeros for the new bodies) '''
+        aligned = np.zeros(shape, dtype=prev[field].dtype)
+        exists = prev_idx >= 0
+        aligned[exists] = prev[field][prev_idx[exists]]
+        return aligned
+
+    def _get_delta(self, prev: dict, state: dict) -> dict:
+        prev_idx = self._align(prev['ids'], state['ids'])
+        delta = {'ids': state['ids'], 'tick_time': state['tick_time'], 'time_passed': state['time_passed']}
+        for field in self.FIELDS:
+            old = self._get_aligned(prev, field, prev_idx, state[field].shape)
+            delta[field] = state[field].view(np.uint64) ^ old.view(np.uint64)
+        # the names are only stored for the new bodies and the renamed ones
+        old_names = self._get_aligned(prev, 'names', prev_idx, state['names'].shape)
+        changed = np.flatnonzero((prev_idx < 0) | (old_names != state['names']))
+        delta['name_idx'] = changed
+        delta['names'] = state['names'][changed]
+        return delta
+
+    def _apply_delta(self, prev: dict, delta: dict) -> dict:
+        prev_idx = self._align(prev['ids'], delta['ids'])
+        state = {'ids': delta['ids'], 'tick_time': delta['tick_time'], 'time_passed': delta['time_passed']}
+        for field in self.FIELDS:
+            old = self._get_aligned(prev, field, prev_idx, delta[field].shape)
+            state[field] = (delta[field] ^ old.view(np.uint64)).view(old.dtype)
+        names = self._get_aligned(prev, 'names', prev_idx, delta['ids'].shape).astype(object)
+        names[delta['name_idx']] = delta['names']
+        state['names'] = names.astype(str)
+        return state
+
+    def _pack(self, arrays: dict) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return zlib.compress(buffer.getvalue(), self.compress_level)
+
+    def _read_payload(self, file, index: int) -> dict:
+        offset = self.records[index][0]
+        file.seek(offset)
+        _, _, length = self.HEADER.unpack(file.read(self.HEADER.size))
+        with np.load(io.BytesIO(zlib.decompress(file.read(length))), allow_pickle=False) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def _read_records(self) -> None:
+        '''
+            Reads the header of every checkpoint in the log, a checkpoint that was only partially
+            written (for example because the program was closed) is removed
+        '''
+        with open(self.file_path, 'rb+') as file:
+            offset = 0
+            while True:
+                header = file.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                kind, time_passed, length = self.HEADER.unpack(header)
+                file.seek(length, os.SEEK_CUR)
+                if file.tell() > os.fstat(file.fileno()).st_size:
+                    break
+                self.records.append((offset, kind, time_passed))
+                offset = file.tell()
+            file.truncate(offset)
@@ -0,0 +1,282 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from body import Body
+from events import get_neighbour_pairs
+from kepler import step_bodies
+from physics import get_external_accelerations
+
+EXPANSION_RADII = 10 # point masses farther than this many radii of a cluster attract it with an expansion of their
+                     # field, the error is about a tenth of the tidal acceleration (see get_far_field())
+
+_executor = None # the threads the clusters are stepped on, they're only started the first time they're needed
+_executor_lock = threading.Lock() # the clusters might be stepped on more than one thread (like the orbit prediction)
+
+class ClusterStepper:
+    '''
+        Steps the bodies of a space as separate clusters (like two solar systems side by side) instead of coupling
+        every body to every other.\n
+        Every INTERVAL steps the bodies are grouped again: the bodies closer than the link length are in the same
+        cluster, the clusters torn apart by the tides of another one (its tidal acceleration across them is more
+        than tidal_threshold times the gravity holding them together) are split in loose bodies, the loose bodies
+        bound to a heavier cluster join it, then the clusters too close to another one for its far field to look like
+        the one of a point mass are merged with it. The bodies left loose (like the ones thrown out of a system) are
+        stepped together, and they attract the rest as single bodies.\n
+        Each cluster is then stepped on its own, in parallel, with as many substeps as its dynamical time needs, and
+        the rest of the clusters attract its bodies as point masses in their centres of mass, moving in a straight
+        line during the step. A space that's a single cluster is stepped like without clusters\n
+        It's off by default (see Space.clusters), since the substeps change the trajectories of the bodies
+    '''
+    INTERVAL = 50 # steps between each detection of the clusters
+    LINK_LENGTH = 100 # (in pixels) bodies closer than this are always in the same cluster
+    TIDAL_THRESHOLD = 0.1 # clusters are torn apart when the tidal acceleration is above this fraction of the internal one
+    SEPARATION = 4 # the far field of a cluster is taken as the one of a point mass from this many times its mass
+                   # weighted radius (the error is about the square of the ratio, and a star makes the radius tiny)
+    MAX_CLUSTERS = 1024 # with more clusters than this (each one is checked against the others) they're all merged
+    ETA = {'euler': 0.01, 'wisdom-holman': 0.1} # fraction of the dynamical time of a cluster each of its substeps lasts
+    MAX_SUBSTEPS = 64
+    PARALLEL_MIN_BODIES = 512 # with fewer bodies the clusters are stepped one after the other
+
+    def __init__(self, link_length=LINK_LENGTH, tidal_threshold=TIDAL_THRESHOLD) -> None:
+        self.link_length = link_length
+        self.tidal_threshold = tidal_threshold
+        self.bodies = None # the bodies the clusters were detected for
+        self.count = 0 # amount of bodies they were detected for
+        self.steps = 0 # steps since the last detection
+        self.labels = np.zeros(0, dtype=np.int64) # index of the cluster of each body, the loose ones are the last one
+        self.members = [] # indices of the bodies of each cluster
+        self.loose = False # whether the last cluster is made of the loose bodies
+        self.dynamical_times = np.zeros(0) # (in days) of each cluster, inf for the loose ones
+
+    def copy(self) -> 'ClusterStepper':
+        ''' Returns a stepper with the same settings and no clusters detected yet, so it can be used on another thread '''
+        return ClusterStepper(self.link_length, self.tidal_threshold)
+
+    def step(self, bodies, pos: np.ndarray, vel: np.ndarray, mass: np.ndarray, dt: float, integrator='euler',
+             dtype=np.float64, solver='direct', light_ratio=0) -> tuple:
+        '''
+            Returns the positions and velocities of the bodies after a step of dt days, like kepler.step_bodies() (the
+            arrays passed aren't modified), the clusters are detected again if the bodies changed
+        '''
+        if bodies is not self.bodies or len(bodies) != self.count or self.steps >= self.INTERVAL:
+            self.detect(pos, vel, mass)
+            self.bodies, self.count, self.steps = bodies, len(bodies), 0
+        self.steps += 1
+        if len(self.members) == 1: # stepped exactly like without clusters
+            return step_bodies(pos, vel, mass, dt, integrator, dtype, solver, light_ratio)
+        substeps = self.get_substeps(dt, integrator)
+
+        # what attracts each cluster from outside: the centres of mass of the other clusters and the loose bodies
+        sources_pos, sources_vel, sources_mass, owners = self.get_sources(pos, vel, mass)
+        max_mass = mass.max()
+        tasks = []
+        for idx, members in enumerate(self.members):
+            outside = owners != idx
+            # the bodies stay light or heavy compared to the heaviest body of the whole space
+            heaviest = mass[members].max()
+            light = light_ratio*max_mass/heaviest if heaviest > 0 else light_ratio
+            tasks.append((pos[members], vel[members], mass[members], dt, substeps[idx], integrator, dtype, solver, light,
+                          sources_pos[outside], sources_vel[outside], sources_mass[outside]))
+
+        if len(mass) >= self.PARALLEL_MIN_BODIES and (os.cpu_count() or 1) > 1:
+            results = list(get_executor().map(lambda args: step_cluster(*args), tasks))
+        else:
+            results = [step_cluster(*args) for args in tasks]
+        new_pos, new_vel = np.empty_like(pos), np.empty_like(vel)
+        for members, (cluster_pos, cluster_vel) in zip(self.members, results):
+            new_pos[members], new_vel[members] = cluster_pos, cluster_vel
+        return new_pos, new_vel
+
+    def get_sources(self, pos: np.ndarray, vel: np.ndarray, mass: np.ndarray) -> tuple:
+        '''
+            Returns the positions, velocities and masses of the point masses the clusters are attracted by, and the
+            index of the cluster each one belongs to
+        '''
+        count = len(self.members)-self.loose
+        # the loose bodies (labelled count) are summed in an extra slot that's dropped
+        com_mass = np.bincount(self.labels, mass, count+1)[:count]
+        weights = np.where(com_mass > 0, com_mass, 1)[:,np.newaxis]
+        com_pos = np.stack([np.bincount(self.labels, mass*pos[:,k], count+1)[:count] for k in range(2)], 1)/weights
+        com_vel = np.stack([np.bincount(self.labels, mass*vel[:,k], count+1)[:count] for k in range(2)], 1)/weights
+        owners = np.arange(count)
+        if self.loose:
+            loose = self.members[-1]
+            com_pos, com_vel = np.concatenate((com_pos, pos[loose])), np.concatenate((com_vel, vel[loose]))
+            com_mass, owners = np.concatenate((com_mass, mass[loose])), np.concatenate((owners, np.full(len(loose), count)))
+        return com_pos, com_vel, com_mass, owners
+
+    def get_substeps(self, dt: float, integrator='euler') -> np.ndarray:
+        ''' Returns the amount of substeps each cluster is stepped with during a step of dt days '''
+        substeps = np.ceil(dt/(self.ETA.get(integrator, self.ETA['euler'])*self.dynamical_times))
+        return np.clip(substeps, 1, self.MAX_SUBSTEPS).astype(np.int64)
+
+    def detect(self, pos: np.ndarray, vel: np.ndarray, mass: np.ndarray) -> None:
+        ''' Groups the bodies with the given positions, velocities and masses in clusters and loose bodies '''
+        pos, vel, mass = pos.astype(np.float64), vel.astype(np.float64), mass.astype(np.float64)
+        if len(pos) < 2:
+            labels = np.zeros(len(pos), dtype=np.int64)
+        else:
+            i, j = get_neighbour_pairs(pos, self.link_length)
+            gap = pos[j]-pos[i]
+            close = np.einsum('ij,ij->i', gap, gap) < self.link_length**2
+            labels = get_components(len(pos), i[close], j[close])
+
+        # the clusters torn apart by the tides of another one aren't held together, their bodies become loose
+        while True:
+            count, clusters, com_pos, com_mass, radius, mass_radius, dist = self.measure(labels, pos, mass)
+            if len(clusters) == 0:
+                break
+            # tidal acceleration of the cluster (or body) j across the cluster i (2*G*Mj*Ri/D^3) over the gravity
+            # holding i together (G*Mi/Ri^2)
+            tidal = (2*com_mass[np.newaxis,:]*radius[clusters,np.newaxis]**3/
+                     (np.maximum(com_mass[clusters], 1e-300)[:,np.newaxis]*dist**3))
+            torn = clusters[(tidal > self.tidal_threshold).any(axis=1)]
+            if len(torn) == 0:
+                break
+            labels = np.where(np.isin(labels, torn), count+np.arange(len(pos)), labels)
+            labels = np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+        # each loose body joins the heavier cluster (or body) pulling it the most if it's bound to it, like the
+        # planets of a star farther than the link length, so only the ones really on their own stay loose
+        count, clusters, com_pos, com_mass, radius, mass_radius, dist = self.measure(labels, pos, mass)
+        loose = np.flatnonzero(np.bincount(labels, minlength=count) == 1)
+        if len(loose) != 0 and count > 1 and len(loose)*count <= self.MAX_CLUSTERS**2:
+            weights = np.where(com_mass > 0, com_mass, 1)[:,np.newaxis]
+            com_vel = np.stack([np.bincount(labels, mass*vel[:,k], count) for k in range(2)], 1)/weights
+            diff = com_pos[np.newaxis,:,:]-com_pos[loose,np.newaxis,:]
+            dist_sq = np.einsum('ijk,ijk->ij', diff, diff)
+            dist_sq[np.arange(len(loose)), loose] = np.inf
+            pull = np.where(com_mass[np.newaxis,:] > com_mass[loose,np.newaxis], com_mass/np.maximum(dist_sq, 1e-300), 0)
+            target = pull.argmax(axis=1)
+            rel_vel = com_vel[target]-com_vel[loose]
+            energy = (np.einsum('ij,ij->i', rel_vel, rel_vel)/2-
+                      Body.G_SIM*(com_mass[target]+com_mass[loose])/np.sqrt(dist_sq[np.arange(len(loose)), target]))
+            bound = (pull.max(axis=1) > 0) & (energy < 0)
+            labels = get_components(count, loose[bound], target[bound])[labels]
+
+        # the clusters that are too close to another one (or to a loose body) for its far field to look like the one
+        # of a point mass are merged with it
+        while True:
+            count, clusters, com_pos, com_mass, radius, mass_radius, dist = self.measure(labels, pos, mass)
+            coupled = dist < self.SEPARATION*(mass_radius[clusters,np.newaxis]+mass_radius[np.newaxis,:])
+            if not coupled.any():
+                break
+            i, j = np.nonzero(coupled)
+            labels = get_components(count, clusters[i], j)[labels]
+
+        sizes = np.bincount(labels, minlength=count)
+        clusters = np.flatnonzero(sizes > 1)
+        self.loose = len(clusters) < count
+        # the clusters keep their order, the loose bodies all go in an extra one at the end
+        new_labels = np.full(count, len(clusters))
+        new_labels[clusters] = np.arange(len(clusters))
+        self.labels = new_labels[labels]
+        order = np.argsort(self.labels, kind='stable')
+        self.members = np.split(order, np.cumsum(np.bincount(self.labels, minlength=len(clusters)+self.loose))[:-1])
+        self.dynamical_times = np.full(len(self.members), np.inf)
+        bound = com_mass[clusters] > 0
+        self.dynamical_times[:len(clusters)][bound] = np.sqrt(radius[clusters][bound]**3/(Body.G_SIM*com_mass[clusters][bound]))
+
+    def measure(self, labels: np.ndarray, pos: np.ndarray, mass: np.ndarray) -> tuple:
+        '''
+            Returns the amount of clusters given by the labels of the bodies (counting each loose body as one), the
+            indices of the ones with more than a body, the extents of every one (see get_cluster_extents()), and the
+            distances of the centres of mass of the ones with more than a body from the ones of every cluster.
+            With more than MAX_CLUSTERS clusters of more than a body, every body is put in the same one
+        '''
+        count = labels.max()+1 if len(labels) != 0 else 0
+        clusters = np.flatnonzero(np.bincount(labels, minlength=count) > 1)
+        if len(clusters) > self.MAX_CLUSTERS:
+            labels[:] = 0
+            count, clusters = 1, np.zeros(1, dtype=np.int64)
+        com_pos, com_mass, radius, mass_radius = get_cluster_extents(labels, count, pos, mass)
+        diff = com_pos[np.newaxis,:,:]-com_pos[clusters,np.newaxis,:]
+        dist = np.hypot(diff[:,:,0], diff[:,:,1])
+        dist[np.arange(len(clusters)), clusters] = np.inf
+        return count, clusters, com_pos, com_mass, radius, mass_radius, dist
+
+def get_executor() -> ThreadPoolExecutor:
+    ''' Returns the thread pool the clusters are stepped on, numpy and the numba kernel release the gil '''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        return _executor
+
+def step_cluster(pos, vel, mass, dt, substeps, integrator, dtype, solver, light_ratio, sources_pos, sources_vel,
+                 sources_mass) -> tuple:
+    '''
+        Returns the positions and velocities of the bodies of a cluster after dt days, split in substeps, attracted by
+        the point masses starting from sources_pos and moving with sources_vel (see get_far_field())
+    '''
+    sub_dt = dt/substeps
+    for substep in range(substeps):
+        start = substep*sub_dt
+        def external(points, time, start=start):
+            return get_far_field(points, mass, sources_pos+sources_vel*(start+time), sources_mass)
+        pos, vel = step_bodies(pos, vel, mass, sub_dt, integrator, dtype, solver, light_ratio, external)
+    return pos, vel
+
+def get_far_field(points: np.ndarray, mass: np.ndarray, sources_pos: np.ndarray, sources_mass: np.ndarray) -> np.ndarray:
+    '''
+        Returns the acceleration of the bodies of a cluster (with the given positions and masses) caused by the point
+        masses outside of it. The ones farther than EXPANSION_RADII times the radius of the cluster from its centre
+        of mass attract it with the first two terms of the expansion of their field around the centre (the
+        acceleration there plus the tidal tensor times the offset from it), which is O(bodies+sources) instead of
+        O(bodies*sources), the closer ones attract each body exactly
+    '''
+    points = points.astype(np.float64)
+    total = mass.sum()
+    center = mass@points/total if total > 0 else points.mean(axis=0)
+    offset = points-center
+    radius = np.sqrt(np.einsum('ij,ij->i', offset, offset).max())
+    diff = sources_pos-center
+    dist = np.hypot(diff[:,0], diff[:,1])
+    far = dist > EXPANSION_RADII*radius
+    acc = get_external_accelerations(points, sources_pos[~far], sources_mass[~far], np.float64)
+    if far.any():
+        diff, coeff = diff[far], Body.G_SIM*sources_mass[far]/dist[far]**3
+        tidal = 3*np.einsum('i,ij,ik->jk', coeff/dist[far]**2, diff, diff)-coeff.sum()*np.eye(2)
+        acc += coeff@diff+offset@tidal # the tidal tensor is symmetric
+    return acc
+
+def get_components(count: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    '''
+        Returns the index of the connected component of each of count nodes linked by the edges (i, j), the components
+        are numbered from 0 in the order of their first node
+    '''
+    labels = np.arange(count)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, i, low)
+        np.minimum.at(new_labels, j, low)
+        new_labels = new_labels[new_labels] # pointer jumping, each label points to a node of the same component
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+def get_cluster_extents(labels: np.ndarray, count: int, pos: np.ndarray, mass: np.ndarray) -> tuple:
+    '''
+        Returns the (count,2) centres of mass, the (count,) masses, radii (the distance of the farthest body from the
+        centre of mass) and mass weighted radii (the root mean square of the distances, weighted by the masses) of
+        the clusters given by the labels of the bodies
+    '''
+    com_mass = np.bincount(labels, mass, count)
+    weights = np.where(com_mass > 0, com_mass, 1)
+    com_pos = np.stack([np.bincount(labels, mass*pos[:,k], count) for k in range(2)], 1)/weights[:,np.newaxis]
+    sizes = np.bincount(labels, minlength=count)
+    empty = com_mass <= 0 # massless clusters are centered on their bodies
+    if empty.any():
+        center = np.stack([np.bincount(labels, pos[:,k], count) for k in range(2)], 1)/np.maximum(sizes, 1)[:,np.newaxis]
+        com_pos[empty] = center[empty]
+    offset = pos-com_pos[labels]
+    dist_sq = np.einsum('ij,ij->i', offset, offset)
+    radius = np.zeros(count)
+    np.maximum.at(radius, labels, np.sqrt(dist_sq))
+    mass_radius = np.sqrt(np.bincount(labels, mass*dist_sq, count)/weights)
+    radius[sizes < 2] = 0 # instead of the rounding error
+    mass_radius[sizes < 2] = 0
+    return com_pos, com_mass, radius, mass_radius
@@ -6,8 +6,6 @@ class Display():
         self.w, self.h = w, h
         self.fullscreen = False
         self.brightness = 255
-        self.brightness_mask = pygame.Surface((w,h), pygame.SRCALPHA)
-        self.brightness_mask.fill((0,0,0,0))
 
     def create(self, caption: str, icon: pygame.Surface, fullscreen=False) -> None:
         self.win = pygame.display.set_mode((self.w, self.h))
@@ -15,20 +13,39 @@ class Display():
         pygame.display.set_icon(icon)
         self.fullscreen = fullscreen
 
+    def render_splash(self, logo: pygame.Surface) -> None:
+        '''
+            Shows the logo in the middle of the window until the first frame is rendered
+        '''
+        self.win.fill((0,0,0))
+        self.win.blit(logo, logo.get_rect(center=(self.w//2, self.h//2)))
+        pygame.display.flip()
+
     def on_resize(self, new_w, new_h, fullscreen=False):
         self.w, self.h = new_w, new_h
         self.fullscreen = fullscreen
         self.win = pygame.display.set_mode((new_w, new_h), pygame.FULLSCREEN if fullscreen else 1)
-        self.brightness_mask = pygame.Surface((new_w,new_h), pygame.SRCALPHA)
-        self.brightness_mask.fill((0,0,0,255-self.brightness))
+
+    def create_buffer(self) -> pygame.Surface:
+        '''
+            Returns an opaque surface of the size of the window in its same pixel format, everything
+            is drawn on it before it's rendered on the window
+        '''
+        return pygame.Surface((self.w, self.h)).convert()
 
     def set_brightness(self, brightness: int) -> None:
-        self.brightness_mask.fill((0,0,0,255-brightness))
         self.brightness = brightness
 
     def render(self, surf: pygame.Surface):
+        if self.brightness == 255:
+            self.win.blit(surf, (0,0))
+            return
+        # blending the frame with a black window darkens it in a single pass, instead of blending a
+        # transparent black mask over it afterwards
+        self.win.fill((0,0,0))
+        surf.set_alpha(self.brightness)
         self.win.blit(surf, (0,0))
-        self.win.blit(self.brightness_mask, (0,0))
+        surf.set_alpha(None)
 
     def get_size(self) -> tuple:
-        return (self.w, self.h)
\ No newline at end of file
+        return (self.w, self.h)
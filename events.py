@@ -0,0 +1,119 @@
+import collections
+import numpy as np
+import pygame
+
+# posted for every encounter found by an EncounterDetector, the gui events go up to USEREVENT+7 and SPACE_SAVED_EVENT is +8
+ENCOUNTER_EVENT = pygame.USEREVENT+9
+
+# kind is 'close approach' or 'collision', time is in days, bodies is the pair of bodies and distance is the gap
+# between their surfaces (in pixels) at that time
+Encounter = collections.namedtuple('Encounter', ['kind', 'time', 'bodies', 'distance'])
+
+class EncounterDetector:
+    '''
+        Finds the close approaches (the smallest gap between the surfaces of two bodies is below close_distance) and
+        the collisions (their surfaces start touching) that happen inside each step, at the time they happen.\n
+        The candidate pairs are the bodies in neighbouring cells of a grid with cells as big as two bodies can be while
+        still getting close during the step, so there's no scan over every pair. Inside the step the bodies move in
+        a straight line (which is exactly what the euler step does), so the time of the smallest distance and of the
+        contact are solved in closed form.\n
+        Every encounter is added to the log and posted as ENCOUNTER_EVENT
+    '''
+    CLOSE_DISTANCE = 5 # (in pixels) gap between the surfaces of two bodies under which they're having a close approach
+    LOG_SIZE = 1000 # encounters kept in the log, the older ones are dropped
+    GRID_MIN_BODIES = 64 # with fewer bodies every pair is a candidate, it's faster than building the grid
+
+    def __init__(self, close_distance=CLOSE_DISTANCE) -> None:
+        self.close_distance = close_distance
+        self.log = collections.deque(maxlen=self.LOG_SIZE) # the latest encounters, oldest first
+
+    def detect(self, bodies, start_pos: np.ndarray, end_pos: np.ndarray, start_time: float, dt: float) -> list:
+        '''
+            Returns the encounters (sorted by time) between the bodies during the step that moved them from
+            start_pos to end_pos, which started at start_time and lasted dt days
+        '''
+        if len(bodies) < 2:
+            return []
+        radius = np.fromiter((body.radius for body in bodies), dtype=np.float64, count=len(bodies))
+        start_pos, end_pos = start_pos.astype(np.float64), end_pos.astype(np.float64)
+        moved = end_pos-start_pos
+        if len(bodies) < self.GRID_MIN_BODIES:
+            i, j = np.triu_indices(len(bodies), 1)
+        else:
+            reach = self.close_distance+2*radius.max()+2*np.hypot(moved[:,0], moved[:,1]).max()
+            i, j = get_neighbour_pairs(start_pos, max(reach, 1e-9))
+
+        gap = start_pos[j]-start_pos[i]
+        rel_moved = moved[j]-moved[i]
+        contact = radius[i]+radius[j]
+        a = np.einsum('ij,ij->i', rel_moved, rel_moved)
+        b = np.einsum('ij,ij->i', gap, rel_moved)
+        c = np.einsum('ij,ij->i', gap, gap)
+        # fraction of the step with the smallest distance, only the minimums inside this step are counted so the
+        # ones right at the end of a step aren't counted again at the start of the next one
+        closest = np.where(a > 0, -b/np.where(a > 0, a, 1), 0)
+        min_gap = np.sqrt(np.maximum(c+closest*(2*b+closest*a), 0))-contact
+        approach = (closest > 0) & (closest <= 1) & (min_gap >= 0) & (min_gap < self.close_distance)
+        # fraction of the step when the distance gets down to the sum of the radii (the smaller root)
+        disc = b*b-a*(c-contact**2)
+        hit = np.where(a > 0, (-b-np.sqrt(np.maximum(disc, 0)))/np.where(a > 0, a, 1), -1)
+        collision = (c > contact**2) & (disc >= 0) & (hit >= 0) & (hit <= 1)
+
+        encounters = []
+        for idx in np.flatnonzero(approach):
+            encounters.append(Encounter('close approach', start_time+closest[idx]*dt, (bodies[i[idx]], bodies[j[idx]]),
+                                        float(min_gap[idx])))
+        for idx in np.flatnonzero(collision):
+            encounters.append(Encounter('collision', start_time+hit[idx]*dt, (bodies[i[idx]], bodies[j[idx]]), 0.0))
+        encounters.sort(key=lambda encounter: encounter.time)
+        for encounter in encounters:
+            self.log.append(encounter)
+            if pygame.display.get_init(): # there's no event queue when running without the gui
+                pygame.event.post(pygame.event.Event(ENCOUNTER_EVENT, encounter=encounter))
+        return encounters
+
+NEIGHBOUR_OFFSETS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)) # half of the neighbouring cells (and the cell itself),
+                                                             # the other half is found from the other side of each pair
+
+def get_neighbour_pairs(pos: np.ndarray, cell_size: float) -> tuple:
+    '''
+        Returns the indices (i, j) with i < j of the pairs of points in the same or in neighbouring square cells of
+        the given size, each pair once. It takes O(N + pairs) time
+    '''
+    keys, stride, order, sorted_keys = _get_cell_keys(pos, cell_size)
+    pairs_i, pairs_j = [], []
+    for dx, dy in NEIGHBOUR_OFFSETS:
+        neighbour_keys = keys+dx*stride+dy
+        first = np.searchsorted(sorted_keys, neighbour_keys, 'left')
+        counts = np.searchsorted(sorted_keys, neighbour_keys, 'right')-first
+        i = np.repeat(np.arange(len(pos)), counts)
+        j = order[np.repeat(first, counts)+np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)]
+        if dx == 0 and dy == 0: # the pairs in the same cell are found from both sides
+            i, j = i[i < j], j[i < j]
+        pairs_i.append(i)
+        pairs_j.append(j)
+    i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+    return np.minimum(i, j), np.maximum(i, j)
+
+def count_neighbour_pairs(pos: np.ndarray, cell_size: float) -> int:
+    '''
+        Returns the amount of pairs get_neighbour_pairs() would return, without building them
+    '''
+    keys, stride, _, sorted_keys = _get_cell_keys(pos, cell_size)
+    count = 0
+    for dx, dy in NEIGHBOUR_OFFSETS:
+        neighbour_keys = keys+dx*stride+dy
+        counts = np.searchsorted(sorted_keys, neighbour_keys, 'right')-np.searchsorted(sorted_keys, neighbour_keys, 'left')
+        count += int(counts.sum()) if dx != 0 or dy != 0 else int(counts.sum()-len(pos))//2 # the pairs in the same cell
+    return count
+
+def _get_cell_keys(pos: np.ndarray, cell_size: float) -> tuple:
+    '''
+        Returns the key of the square cell of the given size each point is in, the difference between the keys of
+        two neighbouring cells (stride for a step along x, 1 along y), the order that sorts the keys and the sorted keys
+    '''
+    cells = np.floor((pos-pos.min(axis=0))/cell_size).astype(np.int64)+1 # +1 so that the neighbours are never negative
+    stride = cells[:,1].max()+2
+    keys = cells[:,0]*stride+cells[:,1]
+    order = np.argsort(keys, kind='stable')
+    return keys, stride, order, keys[order]
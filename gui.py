@@ -1,7 +1,8 @@
 from animations import Animation
 from body import Body
+from prediction import OrbitPredictor
 from widgets import *
-from utils import get_average, get_mg_order, load_spritesheet, adapt_ratio, get_angle, aconvert, get_available_resolutions, get_saves, del_save, parseNum
+from utils import get_average, get_mg_order, load_spritesheet, adapt_ratio, get_angle, aconvert, get_available_resolutions, get_saves, get_cached_save_info, request_save_info, del_save, parseNum
 
 TIME_UPDATE_EVENT = pygame.USEREVENT+1
 GRAPHICS_UPDATE_EVENT = pygame.USEREVENT+2 # updates in brightness or in whether the grav field is rendered
@@ -79,7 +80,7 @@ class TimeUI(UIElement):
         '''
             Updates the text showing the amount of days passed since the beginning
         '''
-        self.time_text = self.font.render(f"Days passed: {int(self.days)}", False, (255,255,255))
+        self.time_text = self.text_cache.render(f"Days passed: {int(self.days)}")
         self.time_text = pygame.transform.scale(self.time_text, adapt_ratio((182,19), self.ratio))
 
     def update(self) -> None:
@@ -123,6 +124,7 @@ class PlanetUI(UIElement):
     # minimum amount of time (in seconds) for which an object has to be clicked in order to change its velocity when it's dragged
     MIN_CLICK_CHANGE_VEL_TIME = 0.1 
     MAX_BODY_PATH_LEN = 500 # the maximum amount of positions rendered when drawing the path of a body
+    PREDICTION_COLOR = (110,140,255) # color of the predicted path of the body
 
     def __init__(self, w, h) -> None:
         super().__init__((int(530*w/800),int(375*h/600)), (int(256*w/800),int(215*h/600)), "gui_background.png", enabled=False)
@@ -132,6 +134,8 @@ class PlanetUI(UIElement):
         # velocity angle setter
         self.body = None
         self.body_path = []
+        self.predictor = OrbitPredictor() # predicts the future path of the body in the background
+        self.time_passed = 0 # days passed in the space when the predicted path was last requested
         self.dragging = False # whether the selected body is being dragged
         self.click_start = 0
 
@@ -188,6 +192,10 @@ class PlanetUI(UIElement):
             return True
         return self.name_textbox.is_on_element(mouse_pos)
 
+    def captures_pointer(self) -> bool:
+        # the selected body can be clicked and dragged anywhere on the screen
+        return self.enabled or self.dragging
+
     def __widgets_click(self, mouse_pos) -> None:
         '''
             Lets every widget handle a click event in the given mouse position, and updates their
@@ -317,6 +325,17 @@ class PlanetUI(UIElement):
         self.orbit_tickbox.set_ticked(False)
         self.body_path = []
 
+    def predict_orbit(self, space) -> None:
+        '''
+            Keeps the predicted path of the selected body up to date with the space, it's called every frame
+            (see OrbitPredictor, the path is only computed again when something changed)
+        '''
+        if not self.enabled or self.body is None:
+            self.predictor.stop()
+            return
+        self.predictor.request(space, self.body)
+        self.time_passed = space.time_passed
+
     def update(self) -> None:
         if not self.enabled:
             return
@@ -331,6 +350,9 @@ class PlanetUI(UIElement):
             return
             
         self.update_texts()
+        path = self.predictor.get_path(self.time_passed)
+        if len(path) != 0:
+            pygame.draw.lines(surf, self.PREDICTION_COLOR, False, [tuple(self.body.pos)]+path.tolist())
         self.body.render_velocity(surf)
 
         # draw body path if "draw orbit" is ticked
@@ -351,6 +373,77 @@ class PlanetUI(UIElement):
         self.vangle_setter.render(surf)
         self.angle_text.render(surf)
 
+class SavePreview(UIElement):
+    BACKGROUND_COLOR = (20,20,30)
+    BODY_COLOR = (230,230,230)
+    TEXT_COLOR = (192,192,192)
+    TEXT_HEIGHT = 0.16 # height of the text relative to the one of the preview
+
+    def __init__(self, pos, size, parent=None) -> None:
+        '''
+            Shows the thumbnail (the most massive bodies) of a save, how many bodies it has and how many days
+            passed in it, everything is read from the saves index so no save is loaded to show it. The saves
+            missing from the index (or modified since) are read on a background thread, and shown once they're read
+        '''
+        super().__init__(pos, size, pygame.Surface(size), parent=parent)
+        self.save_name = None
+        self.pending = None # Future with the information about the save being read in the background
+        self.set_save(None)
+
+    def set_save(self, save_name) -> None:
+        ''' Shows the preview of the save with the given name (nothing if it's None or it doesn't exist) '''
+        self.save_name = save_name
+        self.pending = None
+        self.texture = pygame.Surface(self.size)
+        self.texture.fill(self.BACKGROUND_COLOR)
+        try:
+            info = None if save_name is None else get_cached_save_info(save_name)
+        except OSError: # the save was deleted
+            return
+        if info is None:
+            if save_name is not None:
+                self.pending = request_save_info(save_name)
+            return
+        self.render_info(info)
+
+    def render_info(self, info: dict) -> None:
+        ''' Draws the thumbnail and the amount of bodies and of days of the save with the given information '''
+        text_h = int(self.size[1]*self.TEXT_HEIGHT)
+        self.render_thumbnail(info['thumbnail'], pygame.Rect(0, 0, self.size[0], self.size[1]-text_h))
+        text = self.text_cache.render(f"{info['bodies']} bodies, {int(info['time_passed'])} days", self.TEXT_COLOR)
+        text = pygame.transform.scale(text, (int(text.get_width()*text_h/text.get_height()), text_h))
+        self.texture.blit(text, ((self.size[0]-text.get_width())//2, self.size[1]-text_h))
+
+    def render_thumbnail(self, thumbnail: list, area: pygame.Rect) -> None:
+        '''
+            Draws the bodies of the thumbnail (see utils.get_thumbnail()) in the given area of the texture,
+            scaled so that all of them fit in it
+        '''
+        if len(thumbnail) == 0:
+            return
+        xs, ys = [body[0] for body in thumbnail], [body[1] for body in thumbnail]
+        margin = max(body[2] for body in thumbnail)
+        span_w, span_h = max(xs)-min(xs)+2*margin, max(ys)-min(ys)+2*margin
+        scale = min(area.w/span_w, area.h/span_h)
+        center = ((max(xs)+min(xs))/2, (max(ys)+min(ys))/2)
+        for x, y, radius in thumbnail:
+            pos = (int(area.centerx+(x-center[0])*scale), int(area.centery+(y-center[1])*scale))
+            pygame.draw.circle(self.texture, self.BODY_COLOR, pos, max(1, int(radius*scale)))
+
+    def render(self, surf: pygame.Surface) -> None:
+        if self.pending is not None and self.pending.done():
+            pending, self.pending = self.pending, None
+            # the save might have been deleted or it might be corrupted, then the preview is left empty
+            if not isinstance(pending.exception(), (OSError, ValueError, IndexError, KeyError)):
+                self.render_info(pending.result())
+        super().render(surf)
+
+    def on_click(self, mouse_pos): pass
+
+    def on_window_resize(self, wold, hold, wnew, hnew) -> None:
+        super().on_window_resize(wold, hold, wnew, hnew, resize_widgets=False)
+        self.set_save(self.save_name) # the thumbnail is drawn again instead of scaling the old one
+
 class OptionsMenu(UIElement):
 
     def __init__(self, w, h) -> None:
@@ -367,9 +460,10 @@ class OptionsMenu(UIElement):
         self.init_widgets(w,h)
 
     def init_widgets(self, w, h):
+        # the available resolutions are only queried the first time the menu is opened
         self.resolution_list = DropDownList(adapt_ratio((120,40), self.ratio), adapt_ratio((120,32),self.ratio),
-                                            [str(res).replace('(','').replace(')','').replace(', ','x') for res in get_available_resolutions()],
-                                            parent=self, dims=(w,h), initial_element=f"{w}x{h}")
+                                            [f"{w}x{h}"], parent=self, dims=(w,h))
+        self.resolutions_loaded = False
         self.fullscreen_tickbox = Tickbox(adapt_ratio((160,90), self.ratio), adapt_ratio((24,24), self.ratio),
                                             parent=self)
         self.brightness_bar = ProgressBar(adapt_ratio((120, 140), self.ratio), adapt_ratio((120,32), self.ratio),
@@ -392,7 +486,16 @@ class OptionsMenu(UIElement):
                                     entries=[x.split('.')[0] for x in get_saves()], parent=self, dims=(w,h))
         self.delete_button = TextButton(adapt_ratio((156,400), self.ratio), adapt_ratio((64,32),self.ratio),
                                         "Delete", parent=self)
+        self.save_preview = SavePreview(adapt_ratio((18,450), self.ratio), adapt_ratio((220,130), self.ratio), parent=self)
+        self.save_preview.set_save(self.load_list.get_selected() if len(self.load_list.entries) != 0 else None)
         
+    def load_resolutions(self) -> None:
+        ''' Fills the resolutions drop-down list with the available resolutions '''
+        resolutions = [str(res).replace('(','').replace(')','').replace(', ','x') for res in get_available_resolutions()]
+        if len(resolutions) != 0:
+            self.resolution_list.set_entries(resolutions, initial_element=self.resolution_list.get_selected())
+        self.resolutions_loaded = True
+
     def init_animations(self, w) -> None:
         '''
             Initializes the open/close animation of the menu based on the given width of the screen w
@@ -424,6 +527,8 @@ class OptionsMenu(UIElement):
             # opened = True -> the menu being closed -> animation at index 1 = int(True) = int(opened)
             self.slide_animations[int(self.opened)].start() # restart the animation
             self.opened = not self.opened # toggle the opening or closure of the menu
+            if self.opened and not self.resolutions_loaded:
+                self.load_resolutions()
 
         if not self.opened or not self.is_on_element(mouse_pos):
             return
@@ -435,13 +540,15 @@ class OptionsMenu(UIElement):
             self.fullscreen_tickbox.on_click_release(mouse_pos)
             self.grav_field_tickbox.on_click_release(mouse_pos)
             self.save_textbox.on_click_release(mouse_pos)
-            self.load_list.on_click_release(mouse_pos)
+            if self.load_list.on_click_release(mouse_pos):
+                self.save_preview.set_save(self.load_list.get_selected())
             self.delete_list.on_click_release(mouse_pos)
             # if the delete button has been pressed delete the selected world
             if self.delete_button.on_click_release(mouse_pos):
                 del_save(self.delete_list.get_selected())
                 self.load_list.remove_entry(self.delete_list.get_selected()) # remove the space from the other
                 self.delete_list.remove_entry(self.delete_list.get_selected()) # drop down lists
+                self.save_preview.set_save(self.load_list.get_selected() if len(self.load_list.entries) != 0 else None)
                 UIElement.popup_msg.cast("Space deleted!", 3, fade_time=0.4)
                 # remove the element from the other lists so one cannot try to load a deleted space
             if self.load_button.on_click_release(mouse_pos):
@@ -474,6 +581,9 @@ class OptionsMenu(UIElement):
 
         self.save_textbox.handle_event(event)
 
+    def is_shown(self) -> bool:
+        return self.opened and super().is_shown()
+
     def on_window_resize(self, wold, hold, wnew, hnew) -> None:
         super().on_window_resize(wold, hold, wnew, hnew, resize_widgets=True)
         self.ratio = (wnew/800.0, hnew/600.0)
@@ -561,6 +671,11 @@ class BodyHandlerUI(UIElement):
     def is_on_element(self, mouse_pos) -> bool:
         return self.addbody_button.is_on_element(mouse_pos) or self.removebody_button.is_on_element(mouse_pos)
 
+    def captures_pointer(self) -> bool:
+        # the selection rectangle follows the mouse, the bodies menu closes when clicking outside of it
+        # and the buttons are enabled again on the first click release after a body is added
+        return self.selecting or self.bodies_menu.enabled or not self.addbody_button.enabled
+
     def on_mouse_motion(self, mouse_pos) -> None:
         self.addbody_button.on_mouse_motion(mouse_pos)
         self.removebody_button.on_mouse_motion(mouse_pos)
@@ -608,10 +723,11 @@ class BodyMenu(UIElement):
         # TODO: there's not actual point in recreating all the buttons since the size, pos and texture don't change,
         # I just need to change the text instead, and to create new ones when there aren't enough
         self.enabled = True
-        self.bodies_pos = [] # for each body this is its corresponding position, the indexing is the same as the button's
+        # the bodies themselves are kept instead of views of their positions, since the row of a body in Body.STORE
+        # is given to another body once it's deleted
+        self.bodies = list(bodies) # the indexing is the same as the button's
         self.body_buttons = []
         for idx in range(len(bodies)):
-            self.bodies_pos.append(bodies[idx].pos)
             button_size = adapt_ratio((143,48), self.ratio)
             pos = adapt_ratio((18, 70+button_size[1]*idx), self.ratio)
             max_len = len(bodies[idx].name)+1
@@ -629,15 +745,15 @@ class BodyMenu(UIElement):
 
         if self.xpos_text.on_click(mouse_pos):
             # TODO: change the position of each body
-            avg_x_pos = get_average(self.bodies_pos)[0]
+            avg_x_pos = get_average([body.pos for body in self.bodies])[0]
             offset = parseNum(self.xpos_text.text[1:-1])-avg_x_pos # ignore '(' and ','
-            for body_pos in self.bodies_pos:
-                body_pos[0] += offset
+            for body in self.bodies:
+                body.pos[0] += offset
         elif self.ypos_text.on_click(mouse_pos):
-            avg_y_pos = get_average(self.bodies_pos)[1]
+            avg_y_pos = get_average([body.pos for body in self.bodies])[1]
             offset = parseNum(self.ypos_text[1:-1])-avg_y_pos
-            for body_pos in self.bodies_pos:
-                body_pos[1] += offset
+            for body in self.bodies:
+                body.pos[1] += offset
 
         for button in self.body_buttons:
             # the actual click is handled on on_click_release()
@@ -667,7 +783,7 @@ class BodyMenu(UIElement):
 
         for idx in range(len(self.body_buttons)):
             if self.body_buttons[idx].on_click_release(mouse_pos):
-                pygame.event.post(pygame.event.Event(BODIES_SELECT_EVENT, pos=self.bodies_pos[idx], size=(1,1)))
+                pygame.event.post(pygame.event.Event(BODIES_SELECT_EVENT, pos=self.bodies[idx].pos, size=(1,1)))
 
     
     def render(self, surf: pygame.Surface) -> None:
@@ -0,0 +1,127 @@
+import numpy as np
+from body import Body
+from physics import get_accelerations
+
+INTEGRATORS = ('euler', 'wisdom-holman') # how Space.update() steps the bodies, see step_wisdom_holman()
+MAX_ITERATIONS = 50 # newton iterations of the kepler solver
+TOLERANCE = 1e-12 # relative change of the universal anomaly after which the kepler solver stops
+
+def step_bodies(pos: np.ndarray, vel: np.ndarray, mass: np.ndarray, dt: float, integrator='euler', dtype=np.float64,
+                solver='direct', light_ratio=0, external=None) -> tuple:
+    '''
+        Returns the positions and velocities of the bodies after a step of dt days with the given integrator (one of
+        INTEGRATORS), the arrays passed aren't modified. dtype, solver and light_ratio are passed to get_accelerations().\n
+        external -> function (pos, time) returning the (N,2) accelerations caused by something else than the bodies
+        at the given positions, time days after the start of the step (see clusters.py), None if there's nothing else
+    '''
+    if integrator == 'wisdom-holman':
+        return step_wisdom_holman(pos, vel, mass, dt, dtype, solver, light_ratio, external)
+    acc = get_accelerations(pos, mass, dtype, solver, light_ratio)
+    if external is not None:
+        acc = acc+external(pos, 0)
+    vel = vel+acc*dt
+    return pos+vel*dt, vel
+
+def get_stumpff(z: np.ndarray) -> tuple:
+    '''
+        Returns the stumpff functions C(z) and S(z) of the universal variable formulation of the kepler problem
+        (z > 0 for ellipses, z < 0 for hyperbolas), their series are used close to 0 where the closed forms cancel out
+    '''
+    c, s = np.empty_like(z), np.empty_like(z)
+    small, ellipse, hyperbola = np.abs(z) < 1e-3, z >= 1e-3, z <= -1e-3
+    zs = z[small]
+    c[small] = 1/2-zs/24+zs*zs/720
+    s[small] = 1/6-zs/120+zs*zs/5040
+    root = np.sqrt(z[ellipse])
+    c[ellipse] = (1-np.cos(root))/z[ellipse]
+    s[ellipse] = (root-np.sin(root))/root**3
+    root = np.sqrt(-z[hyperbola])
+    c[hyperbola] = (np.cosh(root)-1)/-z[hyperbola]
+    s[hyperbola] = (np.sinh(root)-root)/root**3
+    return c, s
+
+def kepler_drift(pos: np.ndarray, vel: np.ndarray, gm: np.ndarray, dt: float) -> tuple:
+    '''
+        Returns the positions and velocities after dt days of the (N,2) bodies moving on kepler orbits (of any
+        eccentricity) around a fixed center in the origin, solved analytically with the universal anomaly.\n
+        gm -> (N,) G times the mass attracting each body (in pixels^3/day^2)
+    '''
+    r0 = np.hypot(pos[:,0], pos[:,1])
+    valid = r0 > 0 # a body in the center just keeps going
+    r0 = np.where(valid, r0, 1)
+    sqrt_gm = np.sqrt(gm)
+    radial_vel = np.einsum('ij,ij->i', pos, vel)/r0
+    alpha = 2/r0-np.einsum('ij,ij->i', vel, vel)/gm # 1/semi-major axis, negative for hyperbolas
+
+    chi = sqrt_gm*np.abs(alpha)*dt # the guess is exact for circular orbits
+    chi = np.where(alpha > 0, chi, sqrt_gm*dt/r0)
+    active = valid.copy()
+    for _ in range(MAX_ITERATIONS):
+        x = chi[active]
+        c, s = get_stumpff(alpha[active]*x*x)
+        a, r, v = alpha[active], r0[active], radial_vel[active]/sqrt_gm[active]
+        f = r*v*x*x*c+(1-a*r)*x**3*s+r*x-sqrt_gm[active]*dt
+        df = r*v*x*(1-a*x*x*s)+(1-a*r)*x*x*c+r # the distance from the center at the new position
+        delta = f/df
+        chi[active] = x-delta
+        converged = np.abs(delta) <= TOLERANCE*np.maximum(np.abs(x), 1)
+        active[np.flatnonzero(active)[converged]] = False
+        if not active.any():
+            break
+
+    c, s = get_stumpff(alpha*chi*chi)
+    f = 1-chi*chi/r0*c
+    g = dt-chi**3/sqrt_gm*s
+    new_pos = f[:,np.newaxis]*pos+g[:,np.newaxis]*vel
+    r = np.hypot(new_pos[:,0], new_pos[:,1])
+    df = sqrt_gm/(r*r0)*(alpha*chi**3*s-chi)
+    dg = 1-chi*chi/r*c
+    new_vel = df[:,np.newaxis]*pos+dg[:,np.newaxis]*vel
+    new_pos[~valid] = pos[~valid]+vel[~valid]*dt
+    new_vel[~valid] = vel[~valid]
+    return new_pos, new_vel
+
+def step_wisdom_holman(pos: np.ndarray, vel: np.ndarray, mass: np.ndarray, dt: float, dtype=np.float64,
+                       solver='direct', light_ratio=0, external=None) -> tuple:
+    '''
+        Returns the positions and velocities of the bodies after dt days, stepped with a Wisdom-Holman style
+        splitting: the orbit of every body around the heaviest one (the star) is propagated analytically (see
+        kepler_drift()) for half a step, then the velocities are kicked by the rest of the forces (the other bodies
+        and the acceleration of the star itself) for a whole step, and the orbits are propagated for another half.
+        The forces are computed by get_accelerations() with the given dtype, solver and light_ratio, once per step,
+        and the external ones (see step_bodies()) are added to the kick.
+        As long as the star dominates, the kicks are small and the steps can be far longer than with euler
+    '''
+    if len(mass) < 2:
+        if external is not None: # a lone body is only moved by the external forces, kicked in the middle of the step
+            half = pos+vel*dt/2
+            vel = vel+external(half, dt/2)*dt
+            return half+vel*dt/2, vel
+        return pos+vel*dt, vel.copy()
+    pos, vel, mass = pos.astype(np.float64), vel.astype(np.float64), mass.astype(np.float64)
+    star = int(np.argmax(mass))
+    others = np.arange(len(mass)) != star
+    gm = Body.G_SIM*(mass[star]+mass[others])
+    # heliocentric positions and velocities of the other bodies
+    rel_pos, rel_vel = pos[others]-pos[star], vel[others]-vel[star]
+    star_pos, star_vel = pos[star].copy(), vel[star].copy()
+
+    rel_pos, rel_vel = kepler_drift(rel_pos, rel_vel, gm, dt/2)
+    star_pos += star_vel*dt/2
+
+    pos[others], pos[star] = rel_pos+star_pos, star_pos
+    acc = get_accelerations(pos, mass, dtype, solver, light_ratio).astype(np.float64)
+    if external is not None:
+        acc += external(pos, dt/2)
+    # the kepler part of the heliocentric acceleration is already in the drift
+    dist = np.hypot(rel_pos[:,0], rel_pos[:,1])[:,np.newaxis]
+    kepler_acc = -gm[:,np.newaxis]*rel_pos/np.where(dist > 0, dist, np.inf)**3
+    rel_vel += (acc[others]-acc[star]-kepler_acc)*dt
+    star_vel += acc[star]*dt
+
+    rel_pos, rel_vel = kepler_drift(rel_pos, rel_vel, gm, dt/2)
+    star_pos += star_vel*dt/2
+
+    pos[others], pos[star] = rel_pos+star_pos, star_pos
+    vel[others], vel[star] = rel_vel+star_vel, star_vel
+    return pos, vel
@@ -1,3 +1,5 @@
+import time
+start_time = time.perf_counter() # used to measure the time it takes to render the first frame
 import pygame
 from gui import *
 from space import *
@@ -7,17 +9,24 @@ pygame.init()
 pygame.font.init()
 
 win = Display(800,600)
-surf = pygame.Surface((win.w,win.h), pygame.SRCALPHA)
 fps = 30
 running = True
 clock = pygame.time.Clock()
+FIRST_FRAME_TARGET = 0.5 # maximum amount of seconds from the start of the program to the first frame
+THREADED_PHYSICS = True # whether the physics is stepped on a background thread
+first_frame = True
 
 win.create("Celestia", load_texture("logo.png"))
+preload_images() # the rest of the textures are loaded in the background while the logo is shown
+win.render_splash(load_texture("logo.png"))
+surf = win.create_buffer()
 UIElement.init(W=win.w, H=win.h)
 
 first, second = Body((win.w//2-148,win.h//2+10), 1), Body((win.w//2,win.h//2-10), 3.32954355178996e5)
 first.vel = np.array([0,29.78*1e-6*86400], dtype=np.float64)
 space = Space([first,second], tick_time=1)
+if THREADED_PHYSICS:
+    space.start_worker(steps_per_second=fps)
 
 gui = UI()
 gui.add_widget(PlanetUI(win.w,win.h))
@@ -49,18 +58,25 @@ while running:
                 gui.on_window_resize(win.w, win.h, new_win_size[0], new_win_size[1])
                 win.on_resize(new_win_size[0], new_win_size[1], event.fullscreen)
                 UIElement.init(win.w, win.h)
-                space.on_window_resize(w, h)
-                surf = pygame.Surface(new_win_size) # reinitialize the main surface
+                space.on_window_resize(win.w, win.h)
+                surf = win.create_buffer() # reinitialize the main surface
             win.set_brightness(event.new_brightness)
             space.renders_field = event.field_rendered
         elif event.type == SPACE_SAVE_EVENT:
-            space.save(event.space_name)
+            space.save_async(event.space_name)
+        elif event.type == SPACE_SAVED_EVENT:
+            if not event.success:
+                UIElement.popup_msg.cast("Invalid name!", 3, 0.4)
+        elif event.type == ENCOUNTER_EVENT:
+            if event.encounter.kind == 'collision':
+                first_body, second_body = event.encounter.bodies
+                UIElement.popup_msg.cast(f"{first_body.name} and {second_body.name} collided!", 3, 0.4)
         elif event.type == SPACE_LOAD_EVENT:
-            space.load(event.space_name)
+            space.load(event.space_name, view=(0,0,win.w,win.h))
             gui.get_by_type(TimeUI).set_time_passed(space.time_passed) # make sure to update the gui
         elif event.type == BODY_ADD_EVENT:
             new_body = Body(mouse_pos, 1)
-            space.bodies.append(new_body)
+            space.add_body(new_body)
             gui.get_by_type(PlanetUI).log_body(new_body, mouse_pos=mouse_pos, dragged=True)
         elif event.type == BODY_REMOVE_EVENT:
             # only one planet is selected
@@ -93,17 +109,32 @@ while running:
         gui.handle_event(event, mouse_pos=mouse_pos, mouse_vel=mouse_vel)
 
     surf.fill((0,0,0))
-    if gui.get_by_type(TimeUI).is_time_enabled():
+    # the time is stopped while a huge space is being loaded, only a few of its bodies are added each frame
+    loading = space.poll_loading()
+    time_enabled = gui.get_by_type(TimeUI).is_time_enabled() and not loading
+    if THREADED_PHYSICS:
+        space.sync(paused=not time_enabled) # send the changes made by the gui and get the latest state
+    elif time_enabled:
         space.update()
+    if time_enabled:
         gui.update()
+    space.check_autosave()
+    gui.get_by_type(PlanetUI).predict_orbit(space)
 
     space.render(surf, win.w, win.h)
     gui.render(surf)
 
     win.render(surf)
     pygame.display.flip()
+    if first_frame:
+        first_frame = False
+        startup_time = time.perf_counter()-start_time
+        if startup_time > FIRST_FRAME_TARGET:
+            print(f"First frame rendered after {startup_time:.2f}s (target: {FIRST_FRAME_TARGET}s)")
 
-space.save('autosave')
+space.stop_worker()
+space.save_async(Space.AUTOSAVE_NAME, rotate=Space.MAX_AUTOSAVES)
+Space.SAVE_EXECUTOR.shutdown(wait=True) # wait for every save to be written
 
 pygame.quit()
 pygame.font.quit()
\ No newline at end of file
@@ -0,0 +1,148 @@
+import numpy as np
+from body import Body
+from events import get_neighbour_pairs, count_neighbour_pairs
+
+GRID_SIZE = None # cells on each side of the mesh, None to choose it based on the amount of bodies
+MIN_GRID_SIZE, MAX_GRID_SIZE = 64, 1024
+SPLIT_RADIUS = 1.25 # (in cells) scale of the split between the mesh forces and the short range ones of P3M
+CUTOFF = 4.5 # (in split radii) distance after which the short range forces of P3M are ignored
+MAX_PAIRS_PER_BODY = 64 # budget of short range pairs of P3M, the mesh is refined (and then the split radius is
+                        # shrunk) until the pairs fit in it, so that clustered bodies don't make it quadratic
+MIN_SPLIT_RADIUS = SPLIT_RADIUS/16 # below this the short range forces are left out, like with plain PM
+
+_green_ffts = {} # (grid size, split radius or None) -> fft of the green's function of the mesh, in units of 1/cell
+
+def get_grid_size(num_bodies: int) -> int:
+    '''
+        Returns the power of 2 closest to 2*sqrt(num_bodies) (between MIN_GRID_SIZE and MAX_GRID_SIZE), so that the
+        amount of bodies in each cell (and so the amount of short range pairs of P3M) doesn't grow with them
+    '''
+    return int(np.clip(2**np.round(np.log2(2*np.sqrt(num_bodies))), MIN_GRID_SIZE, MAX_GRID_SIZE))
+
+def get_accelerations_pm(pos: np.ndarray, mass: np.ndarray, grid_size=GRID_SIZE, short_range=False) -> np.ndarray:
+    '''
+        Returns the acceleration (in pixels/day^2) of every body computed with a particle-mesh: the masses are
+        deposited on a grid (cloud in cell), the potential is the convolution of the grid with the green's function
+        of the poisson equation (computed with ffts) and the accelerations are its gradient interpolated back to the
+        bodies. It takes O(N + G log G) time (with G cells), but forces between bodies closer than a couple of cells
+        are smoothed out.\n
+        short_range -> whether to use P3M: the mesh only computes the long range part of the forces and the short
+        range part is summed directly for the pairs closer than CUTOFF split radii. There are at most
+        MAX_PAIRS_PER_BODY pairs for each body (see get_p3m_mesh()), so it takes O(N log N + G log G) time too
+    '''
+    if len(pos) < 2:
+        return np.zeros_like(pos)
+    dtype = pos.dtype.type
+    pos64 = pos.astype(np.float64)
+    # the mesh covers every body, with a cell of margin so that the cloud in cell weights stay in the grid
+    low = pos64.min(axis=0)
+    extent = max(float(np.max(pos64.max(axis=0)-low)), 1e-9)
+    split_radius = None # in cells
+    if short_range:
+        grid_size, split_radius = get_p3m_mesh(pos64, extent, grid_size)
+    elif grid_size is None:
+        grid_size = get_grid_size(len(pos))
+    cell = extent/(grid_size-3)
+    origin = low-cell
+
+    # cloud in cell deposit
+    cell_pos = (pos64-origin)/cell
+    corner = np.floor(cell_pos).astype(np.int64)
+    frac = cell_pos-corner
+    density = np.zeros(grid_size*grid_size)
+    for dx, dy, weight in _get_cic_weights(frac):
+        density += np.bincount((corner[:,0]+dx)*grid_size+corner[:,1]+dy, mass*weight, minlength=grid_size*grid_size)
+    density = density.reshape(grid_size, grid_size)
+
+    # the convolution is done on a grid twice as big, so that the mass doesn't wrap around the edges
+    padded = np.zeros((2*grid_size, 2*grid_size))
+    padded[:grid_size,:grid_size] = density
+    potential = np.fft.irfft2(np.fft.rfft2(padded)*_get_green_fft(grid_size, split_radius), s=padded.shape)
+    potential = -Body.G_SIM/cell*potential[:grid_size,:grid_size]
+    field_x, field_y = np.gradient(-potential, cell)
+
+    acc = np.zeros((len(pos), 2))
+    for dx, dy, weight in _get_cic_weights(frac):
+        cx, cy = corner[:,0]+dx, corner[:,1]+dy
+        acc[:,0] += field_x[cx,cy]*weight
+        acc[:,1] += field_y[cx,cy]*weight
+    if split_radius is not None:
+        acc += _get_short_range_accelerations(pos64, mass.astype(np.float64), split_radius*cell)
+    return acc.astype(dtype)
+
+def get_p3m_mesh(pos: np.ndarray, extent: float, grid_size=None) -> tuple:
+    '''
+        Returns the grid size and the split radius (in cells, None to leave out the short range forces) P3M uses
+        for the bodies, which span extent pixels. Clustered bodies have a lot more pairs closer than the cutoff
+        than the bodies spread evenly, so the grid (unless grid_size is given) is refined up to MAX_GRID_SIZE and
+        then the split radius is halved (the mesh computes more of the forces, smoothed) until the short range pairs
+        are at most MAX_PAIRS_PER_BODY for each body
+    '''
+    budget = MAX_PAIRS_PER_BODY*len(pos)
+    fixed = grid_size is not None
+    grid_size = grid_size if fixed else get_grid_size(len(pos))
+    split_radius = SPLIT_RADIUS
+    while count_neighbour_pairs(pos, CUTOFF*split_radius*extent/(grid_size-3)) > budget:
+        if not fixed and grid_size < MAX_GRID_SIZE:
+            grid_size *= 2
+        elif split_radius/2 >= MIN_SPLIT_RADIUS:
+            split_radius /= 2
+        else:
+            return grid_size, None
+    return grid_size, split_radius
+
+def _get_cic_weights(frac: np.ndarray):
+    ''' Yields the offset of each of the 4 cells around the bodies and the weight of the bodies on it '''
+    for dx in (0, 1):
+        for dy in (0, 1):
+            yield dx, dy, (frac[:,0] if dx else 1-frac[:,0])*(frac[:,1] if dy else 1-frac[:,1])
+
+def _get_green_fft(grid_size: int, split_radius=None) -> np.ndarray:
+    '''
+        Returns the fft of 1/r (the green's function of the poisson equation in 3d, since the bodies attract each
+        other with an inverse square law even though they're on a plane) on the padded grid, with r in cells.
+        With a split_radius (in cells) only the long range part erf(r/(2*split_radius))/r is kept
+    '''
+    key = (grid_size, split_radius)
+    if key not in _green_ffts:
+        offsets = np.fft.fftfreq(2*grid_size, 1/(2*grid_size)) # 0, 1, ..., n-1, -n, ..., -1
+        r = np.hypot(offsets[:,np.newaxis], offsets[np.newaxis,:])
+        r[0,0] = 1
+        if split_radius is not None:
+            green = _erf(r/(2*split_radius))/r
+            green[0,0] = 1/(split_radius*np.sqrt(np.pi)) # limit of erf(r/(2*rs))/r for r -> 0
+        else:
+            green = 1/r
+            green[0,0] = 4*np.log(1+np.sqrt(2)) # average of 1/r over the cell
+        _green_ffts[key] = np.fft.rfft2(green)
+    return _green_ffts[key]
+
+def _get_short_range_accelerations(pos: np.ndarray, mass: np.ndarray, split_radius: float) -> np.ndarray:
+    '''
+        Returns the part of the accelerations that the long range green's function of the mesh leaves out, summed
+        over the pairs closer than CUTOFF*split_radius (found with a grid of cells as big as the cutoff, each pair
+        once: it pulls both of its bodies)
+    '''
+    cutoff = CUTOFF*split_radius
+    i, j = get_neighbour_pairs(pos, cutoff)
+    diff = pos[j]-pos[i]
+    dist = np.hypot(diff[:,0], diff[:,1])
+    close = (dist < cutoff) & (dist > 0)
+    i, j, diff, dist = i[close], j[close], diff[close], dist[close]
+    x = dist/(2*split_radius)
+    shape = _erfc(x)+2*x/np.sqrt(np.pi)*np.exp(-x*x) # part of the force the mesh doesn't compute
+    coeff = Body.G_SIM*shape/dist**3
+    acc = np.zeros_like(pos)
+    for k in range(2):
+        acc[:,k] += np.bincount(i, coeff*mass[j]*diff[:,k], minlength=len(pos))
+        acc[:,k] -= np.bincount(j, coeff*mass[i]*diff[:,k], minlength=len(pos))
+    return acc
+
+def _erfc(x: np.ndarray) -> np.ndarray:
+    ''' Complementary error function for x >= 0 (Abramowitz and Stegun 7.1.26, the error is below 1.5e-7) '''
+    t = 1/(1+0.3275911*x)
+    poly = t*(0.254829592+t*(-0.284496736+t*(1.421413741+t*(-1.453152027+t*1.061405429))))
+    return poly*np.exp(-x*x)
+
+def _erf(x: np.ndarray) -> np.ndarray:
+    return 1-_erfc(x)
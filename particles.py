@@ -0,0 +1,108 @@
+import numpy as np
+import pygame
+from body import Body
+from physics import get_external_accelerations
+
+class TestParticles:
+    '''
+        Massless particles (debris, rings, dust...) that are attracted by the bodies of a space but don't attract
+        anything, so a step costs O(bodies*particles) instead of growing with the square of the particles.\n
+        Their positions and velocities are the rows (x, y, vx, vy) of a single array, which doubles its capacity
+        when it's full, and they're rendered as single pixels instead of textures
+    '''
+    MIN_CAPACITY = 1024
+    COLOR = (200,200,200)
+
+    def __init__(self, dtype=np.float64) -> None:
+        self.state = np.zeros((0,4), dtype=dtype)
+        self.count = 0 # the rows after it are free
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def pos(self) -> np.ndarray:
+        ''' (N,2) view of the positions of the particles '''
+        return self.state[:self.count,:2]
+
+    @property
+    def vel(self) -> np.ndarray:
+        ''' (N,2) view of the velocities of the particles '''
+        return self.state[:self.count,2:]
+
+    def add(self, pos: np.ndarray, vel=None) -> None:
+        '''
+            Adds the particles with the (N,2) positions and velocities (at rest if they're None)
+        '''
+        pos = np.asarray(pos, dtype=self.state.dtype).reshape(-1,2)
+        new_count = self.count+len(pos)
+        if new_count > len(self.state):
+            state = np.zeros((max(self.MIN_CAPACITY, 2*len(self.state), new_count), 4), dtype=self.state.dtype)
+            state[:self.count] = self.state[:self.count]
+            self.state = state
+        self.state[self.count:new_count,:2] = pos
+        self.state[self.count:new_count,2:] = 0 if vel is None else vel
+        self.count = new_count
+
+    def add_ring(self, center, mass: float, inner: float, outer: float, count: int, center_vel=(0,0), seed=None) -> None:
+        '''
+            Adds count particles on circular orbits around a body, spread uniformly over the ring between
+            inner and outer (in pixels) from its center.\n
+            center, mass, center_vel -> position, mass (in earth masses) and velocity of the body they orbit
+        '''
+        rng = np.random.default_rng(seed)
+        dist = np.sqrt(rng.uniform(inner**2, outer**2, count)) # uniform over the area of the ring
+        angle = rng.uniform(0, 2*np.pi, count)
+        offset = np.stack((np.cos(angle), np.sin(angle)), 1)
+        speed = np.sqrt(Body.G_SIM*mass/dist)
+        # perpendicular to the offset, in the same direction the earth orbits the sun in the default scene
+        vel = np.stack((offset[:,1], -offset[:,0]), 1)*speed[:,np.newaxis]
+        self.add(np.asarray(center)+offset*dist[:,np.newaxis], vel+np.asarray(center_vel))
+
+    def remove(self, indices) -> None:
+        ''' Removes the particles with the given indices, the order of the others is kept '''
+        kept = np.delete(self.state[:self.count], indices, axis=0)
+        self.state[:len(kept)] = kept
+        self.count = len(kept)
+
+    def clear(self) -> None:
+        self.state = np.zeros((0,4), dtype=self.state.dtype)
+        self.count = 0
+
+    def get_state(self) -> np.ndarray:
+        ''' Returns a copy of the (N,4) rows of the particles '''
+        return self.state[:self.count].copy()
+
+    def set_state(self, state: np.ndarray) -> None:
+        ''' Replaces every particle with the (N,4) rows in state '''
+        self.count = 0 # the array is reused
+        self.add(state[:,:2], state[:,2:])
+
+    def step(self, pos: np.ndarray, mass: np.ndarray, tick_time: float, dtype=None) -> None:
+        '''
+            Moves the particles by tick_time days with the attraction of the bodies with the given positions and
+            masses (before the bodies are moved, like in Space.update()).\n
+            dtype -> the type the accelerations are computed with, by default the one of the particles
+        '''
+        if self.count == 0:
+            return
+        dtype = self.state.dtype.type if dtype is None else dtype
+        self.vel[:] += get_external_accelerations(self.pos, pos, mass, dtype)*dtype(tick_time)
+        self.pos[:] += self.vel*dtype(tick_time)
+
+    def render(self, surf: pygame.Surface) -> None:
+        ''' Renders every particle as a pixel of the surface '''
+        if self.count == 0:
+            return
+        w, h = surf.get_size()
+        pos = np.floor(self.pos).astype(np.int64)
+        visible = (pos[:,0] >= 0) & (pos[:,0] < w) & (pos[:,1] >= 0) & (pos[:,1] < h)
+        x, y = pos[visible,0], pos[visible,1]
+        try:
+            pixels = pygame.surfarray.pixels2d(surf) # a view of the pixels of the surface, nothing is copied
+        except ValueError: # 24 bit surfaces can't be viewed as 2d arrays
+            for point in zip(x.tolist(), y.tolist()):
+                surf.set_at(point, self.COLOR)
+            return
+        pixels[x,y] = surf.map_rgb(self.COLOR)
+        del pixels # the surface is locked while the view exists
@@ -0,0 +1,177 @@
+import threading
+import numpy as np
+from body import Body
+from particle_mesh import get_accelerations_pm
+
+ENGINE = 'numba' # 'numba' (numpy is used instead if it isn't installed) or 'numpy'
+JIT_MIN_BODIES = 32 # with fewer bodies numpy is just as fast
+TILE_SIZE = 256 # bodies in each tile, the positions of a tile of attracting bodies stay in the cache while it's used
+NUMPY_TILE_SIZE = 1024 # bodies in each tile of the numpy engine, each tile needs about 40*NUMPY_TILE_SIZE^2 bytes
+
+_jit_kernel = None # the compiled kernel, numba is only imported when it's first needed since it slows down the startup
+_jit_lock = threading.Lock() # the physics might be stepped on more than one thread
+_kernel_lock = threading.Lock() # the workqueue threading layer can't run a parallel kernel on two threads at once
+THREADING_LAYER = 'workqueue' # tbb (numba's default when installed) hangs the exit once a kernel ran off the main thread
+prange = range # replaced by numba.prange before the kernel is compiled
+
+SOLVERS = ('direct', 'pm', 'p3m') # exact sum over the pairs, particle-mesh, particle-mesh with short range pairs
+PARTITION_ERROR_SAMPLES = 256 # light bodies the error of the partition is measured on (see get_partition_error())
+
+def get_accelerations(pos: np.ndarray, mass: np.ndarray, dtype=np.float64, solver='direct', light_ratio=0) -> np.ndarray:
+    '''
+        Returns the acceleration (in pixels/day^2) of every body caused by the attraction of all the others.\n
+        pos -> (N,2) array with the position of each body (in pixels)\n
+        mass -> (N,) array with the mass of each body (in earth masses)\n
+        dtype -> the type the accelerations are computed with, np.float32 halves the memory traffic but
+        it's only precise enough for scenes that are just looked at (see benchmark.py)\n
+        solver -> one of SOLVERS, the particle-mesh ones (see particle_mesh.py) are meant for huge smooth distributions
+        of mass (like disks and clouds of bodies)\n
+        light_ratio -> the bodies lighter than light_ratio times the heaviest one are light: they're attracted by the
+        others but they don't attract anything, like test particles (see get_partition_error() for the error)
+    '''
+    pos, mass = pos.astype(dtype, copy=False), mass.astype(dtype, copy=False)
+    if light_ratio > 0 and len(mass) != 0:
+        light = mass < light_ratio*mass.max()
+        if light.any():
+            heavy = ~light
+            acc = np.empty_like(pos)
+            acc[heavy] = get_accelerations(pos[heavy], mass[heavy], dtype, solver)
+            acc[light] = get_external_accelerations(pos[light], pos[heavy], mass[heavy], dtype)
+            return acc
+    if solver != 'direct':
+        return get_accelerations_pm(pos, mass, short_range=solver == 'p3m')
+    if ENGINE == 'numba' and len(pos) >= JIT_MIN_BODIES:
+        kernel = get_jit_kernel()
+        if kernel is not None:
+            with _kernel_lock:
+                return kernel(np.ascontiguousarray(pos), np.ascontiguousarray(mass), dtype(Body.G_SIM), TILE_SIZE)
+    return get_accelerations_tiled(pos, mass, NUMPY_TILE_SIZE)
+
+def get_accelerations_tiled(pos: np.ndarray, mass: np.ndarray, tile_size=NUMPY_TILE_SIZE) -> np.ndarray:
+    '''
+        Returns the same accelerations as get_accelerations() computed with numpy, the pairs are computed a tile of
+        tile_size attracted bodies and tile_size attracting bodies at a time, so the temporary arrays never
+        take more than about 40*tile_size^2 bytes whatever the amount of bodies
+    '''
+    G = pos.dtype.type(Body.G_SIM)
+    acc = np.zeros_like(pos)
+    for start in range(0, len(pos), tile_size):
+        targets = pos[start:start+tile_size]
+        for other_start in range(0, len(pos), tile_size):
+            sources = pos[other_start:other_start+tile_size]
+            diff = sources[np.newaxis,:,:]-targets[:,np.newaxis,:] # diff[i,j] is the vector from the i-th body to the j-th one
+            dist_sq = np.einsum('ijk,ijk->ij', diff, diff)
+            if start == other_start:
+                np.fill_diagonal(dist_sq, np.inf) # a body doesn't attract itself
+            coeff = G*mass[np.newaxis,other_start:other_start+tile_size]/(dist_sq*np.sqrt(dist_sq))
+            acc[start:start+tile_size] += np.einsum('ij,ijk->ik', coeff, diff)
+    return acc
+
+def get_external_accelerations(points: np.ndarray, pos: np.ndarray, mass: np.ndarray, dtype=np.float64,
+                               tile_size=NUMPY_TILE_SIZE) -> np.ndarray:
+    '''
+        Returns the acceleration (in pixels/day^2) of each of the (M,2) points caused by the bodies, which aren't
+        attracted back (see particles.py). It takes O(M*N) time, a tile of points and of bodies at a time.
+        A point exactly on a body isn't attracted by it
+    '''
+    points, pos, mass = points.astype(dtype, copy=False), pos.astype(dtype, copy=False), mass.astype(dtype, copy=False)
+    G = dtype(Body.G_SIM)
+    acc = np.zeros_like(points)
+    for start in range(0, len(points), tile_size):
+        # the coordinates are kept apart, the (M,N,2) differences are about twice as slow with few bodies
+        x, y = points[start:start+tile_size,0,np.newaxis], points[start:start+tile_size,1,np.newaxis]
+        for other_start in range(0, len(pos), tile_size):
+            sources = pos[other_start:other_start+tile_size]
+            dx, dy = sources[:,0]-x, sources[:,1]-y
+            dist_sq = dx*dx+dy*dy
+            dist_sq[dist_sq == 0] = np.inf
+            coeff = G*mass[other_start:other_start+tile_size]/(dist_sq*np.sqrt(dist_sq))
+            acc[start:start+tile_size,0] += (coeff*dx).sum(axis=1)
+            acc[start:start+tile_size,1] += (coeff*dy).sum(axis=1)
+    return acc
+
+def get_partition_error(pos: np.ndarray, mass: np.ndarray, light_ratio: float, samples=PARTITION_ERROR_SAMPLES) -> tuple:
+    '''
+        Returns the largest error of the accelerations of get_accelerations() with the given light_ratio on the heavy
+        bodies (the attraction of the light ones is skipped) and on the light ones (the attraction between each
+        other is skipped), relative to the largest exact acceleration (the error of a body relative to its own
+        acceleration is meaningless for a star that barely moves). The first one is exact, the second one is
+        measured on (at most) samples light bodies spread evenly among them
+    '''
+    if light_ratio <= 0 or len(mass) == 0:
+        return 0.0, 0.0
+    light = mass < light_ratio*mass.max()
+    if not light.any():
+        return 0.0, 0.0
+    heavy = ~light
+    errors, largest = [], 0.0
+    for targets in (np.flatnonzero(heavy), np.flatnonzero(light)[np.linspace(0, light.sum()-1, samples).astype(np.int64)]):
+        targets = np.unique(targets)
+        skipped = get_external_accelerations(pos[targets], pos[light], mass[light])
+        exact = skipped+get_external_accelerations(pos[targets], pos[heavy], mass[heavy])
+        errors.append(float(np.hypot(skipped[:,0], skipped[:,1]).max()))
+        largest = max(largest, float(np.hypot(exact[:,0], exact[:,1]).max()))
+    return tuple(error/max(largest, 1e-300) for error in errors)
+
+def get_potential_and_field(points: np.ndarray, pos: np.ndarray, mass: np.ndarray, tile_size=NUMPY_TILE_SIZE) -> tuple:
+    '''
+        Returns the gravitational potential (in pixels^2/day^2) and the field (the acceleration, in pixels/day^2)
+        caused by the bodies at each of the (M,2) points, computed a tile of points and of bodies at a time.
+        The distances are softened by a pixel, so that the points on a body don't divide by 0
+    '''
+    G = Body.G_SIM
+    potential = np.zeros(len(points))
+    field = np.zeros((len(points), 2))
+    for start in range(0, len(points), tile_size):
+        targets = points[start:start+tile_size]
+        for other_start in range(0, len(pos), tile_size):
+            diff = pos[np.newaxis,other_start:other_start+tile_size,:]-targets[:,np.newaxis,:]
+            inv_dist = 1/np.sqrt(np.einsum('ijk,ijk->ij', diff, diff)+1)
+            weighted = mass[np.newaxis,other_start:other_start+tile_size]*inv_dist
+            potential[start:start+tile_size] -= G*weighted.sum(axis=1)
+            field[start:start+tile_size] += np.einsum('ij,ijk->ik', G*weighted*inv_dist**2, diff)
+    return potential, field
+
+def get_jit_kernel():
+    '''
+        Returns the compiled version of _accelerations_kernel(), None if numba isn't installed (and from then
+        on ENGINE is 'numpy'). The compiled code is cached in __pycache__, so it's only compiled the first
+        time the program runs and then just loaded
+    '''
+    global _jit_kernel, ENGINE, prange
+    with _jit_lock:
+        if _jit_kernel is None:
+            try:
+                import numba
+            except ImportError: # optional, the accelerations are computed with numpy without it
+                ENGINE = 'numpy'
+                return None
+            prange = numba.prange
+            numba.config.THREADING_LAYER = THREADING_LAYER # the kernel runs on the physics worker's thread
+            _jit_kernel = numba.njit(parallel=True, cache=True, fastmath=True)(_accelerations_kernel)
+        return _jit_kernel
+
+def _accelerations_kernel(pos, mass, G, tile_size):
+    '''
+        Same as get_accelerations(), the pairs are computed a tile (of attracted and attracting bodies) at a time
+        without any temporary (N,N) array, and the tiles of attracted bodies are split between the threads
+    '''
+    n = pos.shape[0]
+    acc = np.zeros_like(pos)
+    for tile in prange((n+tile_size-1)//tile_size):
+        start, end = tile*tile_size, min((tile+1)*tile_size, n)
+        for other_start in range(0, n, tile_size):
+            other_end = min(other_start+tile_size, n)
+            for i in range(start, end):
+                x, y = pos[i,0], pos[i,1]
+                ax, ay = acc[i,0], acc[i,1]
+                for j in range(other_start, other_end):
+                    if j == i: # a body doesn't attract itself
+                        continue
+                    dx, dy = pos[j,0]-x, pos[j,1]-y
+                    dist_sq = dx*dx+dy*dy
+                    coeff = G*mass[j]/(dist_sq*np.sqrt(dist_sq))
+                    ax += coeff*dx
+                    ay += coeff*dy
+                acc[i,0], acc[i,1] = ax, ay
+    return acc
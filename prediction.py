@@ -0,0 +1,104 @@
+import threading
+import time
+import numpy as np
+from kepler import step_bodies
+
+class OrbitPredictor:
+    '''
+        Predicts the future path of a body on a background thread, from a copy of the state of its space. The path is
+        extended a chunk of steps at a time, so it can be drawn while it's still being computed, and it's only
+        computed again when the inputs change: the bodies, their masses or how the space is stepped, their positions
+        or velocities while the time is stopped, or the body stops matching the path while the time runs (see
+        request())
+    '''
+    STEPS = 2000 # steps (of the tick time of the space) the path is predicted for
+    CHUNK_STEPS = 25 # steps computed between each update of the path
+    TOLERANCE = 0.5 # (in pixels) distance of the body from its predicted position (or of the step it makes with its
+                    # velocity from the predicted one) after which the path is recomputed
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.stopped = threading.Event() # set to stop the thread computing the current path
+        self.thread = None
+        self.path = [] # predicted (x, y, vx, vy) of the body, one for each step after start_time
+        self.inputs = None # (body, bodies, masses, settings of the space) the path was predicted from
+        self.start_state = None # (positions, velocities) the path was predicted from
+        self.start_time = 0
+        self.tick_time = 1
+
+    def request(self, space, body) -> None:
+        '''
+            Makes sure the path of the body is being predicted from the current state of the space, it's called
+            every frame and it only starts a new prediction if the current one isn't valid anymore
+        '''
+        if body not in space.bodies:
+            self.stop()
+            return
+        pos, vel, mass = space.get_state()
+        inputs = (body, tuple(space.bodies), mass.tobytes(),
+                  (space.tick_time, space.integrator, space.dtype, space.solver, space.light_mass_ratio, space.clusters))
+        if inputs != self.inputs or not self.is_valid(pos, vel, space.time_passed, space.bodies.index(body)):
+            self.start(pos, vel, mass, space.bodies.index(body), space, inputs)
+
+    def is_valid(self, pos: np.ndarray, vel: np.ndarray, time_passed: float, idx: int) -> bool:
+        ''' Returns whether the current path still matches the state of the space (with the same inputs) '''
+        if time_passed == self.start_time: # nothing moved, so only an edit could have changed the state
+            return np.array_equal(pos, self.start_state[0]) and np.array_equal(vel, self.start_state[1])
+        step = round((time_passed-self.start_time)/self.tick_time)-1
+        if step < 0 or step >= self.STEPS//2: # the time went back or half of the path has been passed
+            return False
+        with self.lock:
+            if step >= len(self.path): # the body is ahead of the prediction, it's valid if it's still computed
+                return self.thread is not None and self.thread.is_alive()
+            predicted = self.path[step]
+        return (np.hypot(*(pos[idx]-predicted[:2])) <= self.TOLERANCE and
+                np.hypot(*(vel[idx]-predicted[2:]))*self.tick_time <= self.TOLERANCE)
+
+    def start(self, pos: np.ndarray, vel: np.ndarray, mass: np.ndarray, idx: int, space, inputs: tuple) -> None:
+        '''
+            Starts predicting the path of the body with index idx, the previous prediction is stopped without
+            waiting for it so that the editing of the body (like dragging the angle selector) stays smooth
+        '''
+        self.stopped.set()
+        self.stopped = threading.Event()
+        self.inputs = inputs
+        self.start_state = (pos, vel)
+        self.start_time, self.tick_time = space.time_passed, space.tick_time
+        with self.lock:
+            self.path = []
+        # the path is stepped like the space (see Space.step_bodies()), with its own clusters since they're detected
+        # again as the bodies move
+        clusters = space.clusters.copy() if space.clusters is not None else None
+        settings = (space.tick_time, space.integrator, space.dtype, space.solver, space.light_mass_ratio, clusters)
+        self.thread = threading.Thread(target=self._predict, args=(inputs[1], pos.copy(), vel.copy(), mass, idx, settings,
+                                                                   self.stopped, self.path), daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        ''' Stops the prediction and forgets the path '''
+        self.stopped.set()
+        self.inputs = None
+        with self.lock:
+            self.path = []
+
+    def get_path(self, time_passed: float) -> np.ndarray:
+        ''' Returns the (N,2) positions predicted after time_passed '''
+        step = max(0, round((time_passed-self.start_time)/self.tick_time))
+        with self.lock:
+            return np.array(self.path[step:]).reshape(-1,4)[:,:2]
+
+    def _predict(self, bodies, pos, vel, mass, idx, settings, stopped, path) -> None:
+        tick_time, integrator, dtype, solver, light_ratio, clusters = settings
+        for _ in range(0, self.STEPS, self.CHUNK_STEPS):
+            chunk = []
+            for _ in range(self.CHUNK_STEPS):
+                if clusters is not None:
+                    pos, vel = clusters.step(bodies, pos, vel, mass, tick_time, integrator, dtype, solver, light_ratio)
+                else:
+                    pos, vel = step_bodies(pos, vel, mass, tick_time, integrator, dtype, solver, light_ratio)
+                chunk.append(np.concatenate((pos[idx], vel[idx])))
+            if stopped.is_set(): # the path is another one by now
+                return
+            with self.lock:
+                path.extend(chunk)
+            time.sleep(0) # lets the main thread run between the chunks
@@ -0,0 +1,177 @@
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+
+class RegionSave:
+    '''
+        Binary save of a space meant for huge scenes, the bodies are grouped by the square cell of the space they're in
+        and every cell is compressed on its own, so the bodies in a region of the space can be read without reading
+        the rest of the file. The cells are sorted along a Z-order curve, so the cells close to each other in the space
+        are also close in the file.\n
+        Layout: MAGIC, HEADER, representation of the space (utf-8, see Space.get_str_representation()),
+        table of the cells (CELL), cells (BODY records followed by the utf-8 names of the bodies)
+    '''
+    MAGIC = b'GSREGION'
+    HEADER = struct.Struct('<IQdI') # length of the representation of the space, bodies, size of the cells, cells
+    CELL = np.dtype([('x', '<i4'), ('y', '<i4'), ('count', '<u4'), ('offset', '<u8'), ('length', '<u4')])
+    BODY = np.dtype([('pos', '<f8', 2), ('vel', '<f8', 2), ('mass', '<f8'), ('radius', '<f8'), ('name_len', '<u2')])
+    BODIES_PER_CELL = 256 # average amount of bodies in a cell, the size of the cells is chosen based on it
+    COMPRESS_LEVEL = 1
+
+    @staticmethod
+    def is_region_save(file_path: str) -> bool:
+        with open(file_path, 'rb') as file:
+            return file.read(len(RegionSave.MAGIC)) == RegionSave.MAGIC
+
+    @staticmethod
+    def get_cell_size(pos: np.ndarray) -> float:
+        ''' Returns the size of the cells so that there are about BODIES_PER_CELL bodies in each one '''
+        if len(pos) == 0:
+            return 1.0
+        extent = max(float(np.ptp(pos[:,0])), float(np.ptp(pos[:,1])), 1.0)
+        cells_per_side = max(1, int(np.ceil(np.sqrt(len(pos)/RegionSave.BODIES_PER_CELL))))
+        return extent/cells_per_side
+
+    @staticmethod
+    def get_zorder(cell_x: np.ndarray, cell_y: np.ndarray) -> np.ndarray:
+        ''' Returns the position of each cell along the Z-order curve (the bits of x and y interleaved) '''
+        cell_x, cell_y = cell_x-cell_x.min(), cell_y-cell_y.min()
+        key = np.zeros(len(cell_x), dtype=np.uint64)
+        for bit in range(32):
+            key |= ((cell_x >> bit) & 1).astype(np.uint64) << np.uint64(2*bit)
+            key |= ((cell_y >> bit) & 1).astype(np.uint64) << np.uint64(2*bit+1)
+        return key
+
+    @staticmethod
+    def write(file_path: str, space_repr: str, bodies: list) -> None:
+        '''
+            Writes the region save of a space to the given file.\n
+            space_repr -> string representation of the space\n
+            bodies -> list with the save state of every body, see Body.get_save_state()
+        '''
+        records = np.zeros(len(bodies), dtype=RegionSave.BODY)
+        names = [name.encode('utf-8') for name, *_ in bodies]
+        for idx, (_, mass, pos, vel, radius) in enumerate(bodies):
+            records[idx] = (pos, vel, mass, radius, len(names[idx]))
+        cell_size = RegionSave.get_cell_size(records['pos'])
+        cell_pos = np.floor(records['pos']/cell_size).astype(np.int64)
+        keys = RegionSave.get_zorder(cell_pos[:,0], cell_pos[:,1]) if len(bodies) != 0 else np.zeros(0, np.uint64)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        # index in order of the first body of each cell
+        starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))) if len(keys) != 0 else []
+        ends = np.append(starts[1:], len(order)).astype(np.int64)
+
+        cells = np.zeros(len(starts), dtype=RegionSave.CELL)
+        payloads, offset = [], 0
+        for cell_idx, (start, end) in enumerate(zip(starts, ends)):
+            idx = order[start:end]
+            payload = zlib.compress(records[idx].tobytes()+b''.join(names[i] for i in idx), RegionSave.COMPRESS_LEVEL)
+            cells[cell_idx] = (cell_pos[idx[0],0], cell_pos[idx[0],1], len(idx), offset, len(payload))
+            payloads.append(payload)
+            offset += len(payload)
+
+        space_repr = space_repr.encode('utf-8')
+        with open(file_path, 'wb') as file:
+            file.write(RegionSave.MAGIC)
+            file.write(RegionSave.HEADER.pack(len(space_repr), len(bodies), cell_size, len(cells)))
+            file.write(space_repr)
+            file.write(cells.tobytes())
+            for payload in payloads:
+                file.write(payload)
+
+class RegionReader:
+    '''
+        Reads the cells of a region save (see RegionSave), only the table of the cells is read when it's created
+    '''
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            if file.read(len(RegionSave.MAGIC)) != RegionSave.MAGIC:
+                raise ValueError(f"{file_path} isn't a region save")
+            repr_len, self.num_bodies, self.cell_size, num_cells = RegionSave.HEADER.unpack(file.read(RegionSave.HEADER.size))
+            self.space_repr = file.read(repr_len).decode('utf-8')
+            self.cells = np.frombuffer(file.read(num_cells*RegionSave.CELL.itemsize), dtype=RegionSave.CELL)
+            self.data_start = file.tell()
+
+    def get_load_order(self, view=None) -> np.ndarray:
+        '''
+            Returns the indices of the cells sorted by their distance from the view (x,y,w,h): the cells that overlap
+            it come first, starting from the ones closest to its center. Without a view the order in the file is kept
+        '''
+        if view is None:
+            return np.arange(len(self.cells))
+        x, y, w, h = view
+        left, top = self.cells['x']*self.cell_size, self.cells['y']*self.cell_size
+        # distance of each cell from the view, 0 if they overlap
+        dx = np.maximum(0, np.maximum(x-(left+self.cell_size), left-(x+w)))
+        dy = np.maximum(0, np.maximum(y-(top+self.cell_size), top-(y+h)))
+        from_center = np.hypot(left+self.cell_size/2-(x+w/2), top+self.cell_size/2-(y+h/2))
+        return np.lexsort((from_center, np.hypot(dx, dy)))
+
+    def read_cells(self, indices, file=None) -> dict:
+        '''
+            Returns the bodies in the cells with the given indices as a dictionary with the arrays 'pos', 'vel',
+            'mass' and 'radius', and the list 'names'
+        '''
+        if file is None:
+            with open(self.file_path, 'rb') as file:
+                return self.read_cells(indices, file)
+        records, names = [], []
+        for cell in self.cells[list(indices)]:
+            file.seek(self.data_start+int(cell['offset']))
+            data = zlib.decompress(file.read(int(cell['length'])))
+            cell_records = np.frombuffer(data, dtype=RegionSave.BODY, count=int(cell['count']))
+            names_data, start = data[cell_records.nbytes:], 0
+            for name_len in cell_records['name_len']:
+                names.append(names_data[start:start+name_len].decode('utf-8'))
+                start += name_len
+            records.append(cell_records)
+        records = np.concatenate(records) if len(records) != 0 else np.zeros(0, dtype=RegionSave.BODY)
+        return {'pos': records['pos'], 'vel': records['vel'], 'mass': records['mass'],
+                'radius': records['radius'], 'names': names}
+
+    def stream(self, view=None):
+        '''
+            Starts reading the cells (in the order given by get_load_order()) on a background thread, see RegionStream
+        '''
+        return RegionStream(self, self.get_load_order(view))
+
+class RegionStream:
+    '''
+        Reads the given cells of a region save on a background thread, the bodies of each cell (see
+        RegionReader.read_cells()) are put in the queue as soon as they're read and None is put after the last cell
+    '''
+    MAX_PENDING = 16 # maximum amount of cells read but not taken from the queue yet
+
+    def __init__(self, reader: RegionReader, order) -> None:
+        self.reader = reader
+        self.order = order
+        self.queue = queue.Queue(maxsize=self.MAX_PENDING)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        ''' Stops reading the cells, the ones left in the queue are discarded '''
+        self.stopped.set()
+        self.thread.join()
+
+    def _put(self, item) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _read(self) -> None:
+        with open(self.reader.file_path, 'rb') as file:
+            for idx in self.order:
+                if self.stopped.is_set():
+                    return
+                self._put(self.reader.read_cells((idx,), file))
+        self._put(None)
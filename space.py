@@ -1,11 +1,46 @@
 import numpy as np
 import pygame
+import threading
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from body import *
+from physics import get_partition_error, get_potential_and_field
+from regions import RegionSave, RegionReader
+from particles import TestParticles
+from kepler import step_bodies
+from events import EncounterDetector, Encounter, ENCOUNTER_EVENT
+from clusters import ClusterStepper
 from widgets import UIElement
 
+# state of the space published by the physics worker, the arrays are read-only
+# particles are the rows of the test particles (see particles.py)
+# seq is the number of the last command the worker had handled when the snapshot was taken
+# generation counts the steps and the batches of commands that changed the state, it only grows
+SpaceSnapshot = namedtuple('SpaceSnapshot', ['bodies', 'pos', 'vel', 'particles', 'time_passed', 'seq', 'generation'])
+
+# posted when a space saved in the background has been written (or failed to be), the gui events go up to USEREVENT+7
+SPACE_SAVED_EVENT = pygame.USEREVENT+8
+
 class Space:
-    SAVE_OBJECT_DELIMETER = "-"*20+"\n" # the delimeter between one thing and another when saving the space in a file
+    SAVE_OBJECT_DELIMETER = SAVE_DELIMETER # the delimeter between one thing and another when saving the space in a file
     SAVES_PATH = os.path.join(path, 'saves')
+    SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1) # the saves are written in the background, one at a time
+    AUTOSAVE_NAME = 'autosave'
+    MAX_AUTOSAVES = 3 # amount of autosaves kept (autosave, autosave 1, autosave 2), the older ones are deleted
+    SAVE_COMPRESSION = DEFAULT_COMPRESSION # 'zstd', 'lzma', 'zlib' or None to write plain text saves
+    REGION_SAVE_MIN_BODIES = 5000 # spaces with at least this many bodies are saved as region saves (see regions.py)
+    LOAD_BUDGET = 0.005 # seconds spent adding the bodies of a region save being loaded each frame
+    FIELD_MODES = ('arrows', 'adaptive', 'magnitude', 'potential') # how the gravitational field is rendered
+    FIELD_TILE_SIZE = 4096 # bodies checked at a time for the arrows of the field that are too close to them
+    ADAPTIVE_ROOT_CELLS = 4 # (in margins) size of the cells the quadtree of the adaptive field starts from
+    ADAPTIVE_MIN_CELL = 0.25 # (in margins) cells of the adaptive field smaller than this aren't split
+    ADAPTIVE_MIN_VARIATION = 0.5 # cells where the field changes less than this (relatively) across them aren't split
+    HEATMAP_DOWNSAMPLE = 4 # size (in pixels) of the cells of the heatmap of the field, 1 for every pixel
+    CONTOUR_LEVELS = 8 # contour lines drawn on the heatmap, 0 for none
+    CONTOUR_COLOR = (255,255,255)
+    LIGHT_MASS_RATIO = 1e-5 # bodies lighter than this fraction of the heaviest one don't attract anything by default
 
     def __init__(self, bodies=None, tick_time=1, W=800.0, H=600.0):
         '''
@@ -13,11 +48,28 @@ class Space:
             of a function
         '''
         self.bodies = [] if bodies is None else bodies
+        self.particles = TestParticles() # massless particles, attracted by the bodies without attracting them
         self.tick_time = tick_time
         self.renders_field = True
         self.margin = int(75*(W+H)/1400.0) # margin (in pixels) between each vector in the vector field
         self.time_passed = 0 # days passed
         self.name = "Space"
+        self.worker = None # the physics worker, if the physics is stepped on a background thread
+        self.autosave_interval = 365 # simulated days between each autosave, None to disable them
+        self.last_autosave = 0 # the value of time_passed at the last autosave
+        self.loading = None # the RegionStream of the region save being loaded
+        self.dtype = np.float64 # np.float32 halves the memory traffic of the physics, it's meant for scenes that are only looked at
+        self.solver = 'direct' # how the gravity is computed, see physics.SOLVERS. 'direct' is exact and the fastest up to
+                               # ~5k bodies, 'p3m' is faster from ~10k (1.2-3.5x at 20k) with ~1% error (median), 'pm' is
+                               # ~50x faster but ~10-60% off (smoothed), only for looking at huge smooth clouds of bodies
+        self.integrator = 'euler' # how the bodies are stepped, see kepler.INTEGRATORS
+        self.light_mass_ratio = self.LIGHT_MASS_RATIO # see get_partition_error(), 0 to make every body attract the others
+        self.field_mode = 'arrows' # one of FIELD_MODES
+        self.field_sample_budget = None # samples of the adaptive field each frame, None for as many as the uniform grid
+        self.heatmap = None # surface the heatmap of the field is computed on (see render_field_heatmap())
+        self.loading_cell = None # [bodies of the cell being added, index of the next body to add]
+        self.encounters = EncounterDetector() # finds the close approaches and collisions at each step, None to disable it
+        self.clusters = None # a ClusterStepper steps the decoupled clusters of bodies on their own, None steps them together
 
     def on_window_resize(self, wnew, hnew):
         self.margin = int(75*(wnew+hnew)/1400.0)
@@ -29,33 +81,202 @@ class Space:
         return None
 
     def render_grav_field(self, surf: pygame.Surface, W=800, H=600) -> None:
-        for i in range(0, W, self.margin):
-            for j in range(0, H, self.margin):
-                pos = np.array([i,j])
-                pull = np.sum([body.get_grav_pull(pos, self.tick_time) for body in self.bodies], axis=0)
-                intensity = min(1.35*np.linalg.norm(pull)/(self.tick_time), 3.5*self.margin/150)
-                should_draw = intensity != 0
-                for body in self.bodies:
-                    if np.linalg.norm(pos-body.pos) < self.margin-body.radius:
-                        should_draw = False
-                if not should_draw:
-                    continue
-                draw_vector(surf, pull, intensity, pos)
+        '''
+            Renders arrows with the gravitational pull, every margin pixels or (with the 'adaptive' field_mode) in the
+            cells of a quadtree (see get_adaptive_field_samples()). The pulls are computed together and the arrows
+            (see ArrowAtlas) are drawn with a single blits() call
+        '''
+        if len(self.bodies) == 0:
+            return
+        pos, _, mass = self.get_state()
+        if self.field_mode == 'adaptive':
+            points, sizes, field = self.get_adaptive_field_samples(pos, mass, W, H)
+        else:
+            xs, ys = np.meshgrid(np.arange(0, W, self.margin), np.arange(0, H, self.margin), indexing='ij')
+            points = np.stack((xs.ravel(), ys.ravel()), 1).astype(np.float64)
+            sizes = np.full(len(points), float(self.margin))
+            field = get_potential_and_field(points, pos, mass)[1]
+        pull = field*self.tick_time
+        intensity = np.minimum(1.35*np.hypot(pull[:,0], pull[:,1])/self.tick_time, 3.5*sizes/150)
+        # no arrows on the bodies or too close to them
+        radius = np.array([body.radius for body in self.bodies])
+        near = np.zeros(len(points), dtype=bool)
+        for start in range(0, len(pos), self.FIELD_TILE_SIZE):
+            diff = points[:,np.newaxis,:]-pos[np.newaxis,start:start+self.FIELD_TILE_SIZE,:]
+            tile_radius = radius[np.newaxis,start:start+self.FIELD_TILE_SIZE]
+            min_dist = np.maximum(sizes[:,np.newaxis]-tile_radius, tile_radius)
+            near |= np.any(np.hypot(diff[...,0], diff[...,1]) < min_dist, axis=1)
+        draw = (intensity != 0) & ~near
+        surf.blits(ARROW_ATLAS.get_blits(pull[draw], intensity[draw], points[draw]), False)
+
+    def get_adaptive_field_samples(self, pos: np.ndarray, mass: np.ndarray, W=800, H=600) -> tuple:
+        '''
+            Returns the centers (M,2), the sizes (M,) and the gravitational field (M,2) of the leaves of a quadtree
+            over the screen, with at most field_sample_budget leaves. The cells where the field changes the most
+            across them are split first, a round of splits at a time (so the field of each round is computed
+            together). The change is estimated as if the field came from a single body: |field| = GM/r^2 and
+            |potential| = GM/r, so r = |potential|/|field| and the field changes by about 2*size/r across a cell
+        '''
+        budget = self.field_sample_budget
+        if budget is None:
+            budget = len(range(0, W, self.margin))*len(range(0, H, self.margin))
+        root = self.margin*self.ADAPTIVE_ROOT_CELLS
+        xs, ys = np.meshgrid(np.arange(0, W, root)+root/2, np.arange(0, H, root)+root/2, indexing='ij')
+        points = np.stack((xs.ravel(), ys.ravel()), 1).astype(np.float64)
+        sizes = np.full(len(points), float(root))
+        potential, field = get_potential_and_field(points, pos, mass)
+        quadrants = np.array(((-1,-1), (-1,1), (1,-1), (1,1)))/4 # offsets of the centers of the children (in sizes)
+
+        while True:
+            variation = sizes*np.hypot(field[:,0], field[:,1])/np.maximum(np.abs(potential), 1e-300)
+            candidates = np.flatnonzero((variation > self.ADAPTIVE_MIN_VARIATION) & (sizes/2 >= self.margin*self.ADAPTIVE_MIN_CELL))
+            splits = min((budget-len(points))//3, len(candidates)) # every split replaces a leaf with 4
+            if splits <= 0:
+                break
+            chosen = candidates[np.argsort(-variation[candidates], kind='stable')[:splits]]
+            children = (points[chosen,np.newaxis,:]+quadrants[np.newaxis]*sizes[chosen,np.newaxis,np.newaxis]).reshape(-1,2)
+            child_sizes = np.repeat(sizes[chosen]/2, len(quadrants))
+            # the children outside of the screen aren't drawn, so they aren't sampled
+            visible = (children[:,0] < W) & (children[:,1] < H)
+            children, child_sizes = children[visible], child_sizes[visible]
+            child_potential, child_field = get_potential_and_field(children, pos, mass)
+            kept = np.ones(len(points), dtype=bool)
+            kept[chosen] = False
+            points = np.concatenate((points[kept], children))
+            sizes = np.concatenate((sizes[kept], child_sizes))
+            potential = np.concatenate((potential[kept], child_potential))
+            field = np.concatenate((field[kept], child_field))
+        return points, sizes, field
+
+    def render_field_heatmap(self, surf: pygame.Surface, W=800, H=600) -> None:
+        '''
+            Renders the magnitude of the gravitational field or the potential (depending on field_mode) as a heatmap,
+            with a value for each HEATMAP_DOWNSAMPLE x HEATMAP_DOWNSAMPLE cell and CONTOUR_LEVELS contour lines
+        '''
+        cell = self.HEATMAP_DOWNSAMPLE
+        grid_w, grid_h = -(-W//cell), -(-H//cell)
+        xs, ys = np.meshgrid((np.arange(grid_w)+0.5)*cell, (np.arange(grid_h)+0.5)*cell, indexing='ij')
+        pos, _, mass = self.get_state()
+        potential, field = get_potential_and_field(np.stack((xs.ravel(), ys.ravel()), 1), pos, mass)
+        values = -potential if self.field_mode == 'potential' else np.hypot(field[:,0], field[:,1])
+        # the values span many orders of magnitude, so the logarithm is shown
+        values = np.log10(np.maximum(values, 1e-30)).reshape(grid_w, grid_h)
+        low, high = np.percentile(values, (1, 99.5))
+        values = np.clip((values-low)/max(high-low, 1e-12), 0, 1)
+
+        if self.heatmap is None or self.heatmap.get_size() != (grid_w, grid_h):
+            self.heatmap = pygame.Surface((grid_w, grid_h), 0, 32)
+        pixels = pygame.surfarray.pixels3d(self.heatmap) # a view of the pixels of the surface, nothing is copied
+        pixels[:] = apply_colormap(values)
+        del pixels # the surface is locked while the view exists
+        if cell == 1:
+            surf.blit(self.heatmap, (0,0))
+        else:
+            surf.blit(pygame.transform.scale(self.heatmap, (grid_w*cell, grid_h*cell)), (0,0))
+
+        for level in np.linspace(0, 1, self.CONTOUR_LEVELS+2)[1:-1]:
+            for start, end in (get_contour_segments(values, level)+0.5)*cell:
+                pygame.draw.line(surf, self.CONTOUR_COLOR, start, end)
 
     def update(self) -> None:
-        for i in range(len(self.bodies)):
-            for j in range(len(self.bodies)):
-                if i == j:
-                    continue
-                self.bodies[i].gravitate(self.bodies[j], self.tick_time)
-        
+        pos, vel, mass = self.get_state()
+        self.particles.step(pos, mass, self.tick_time, self.dtype)
+        if len(self.bodies) != 0:
+            start_pos = pos
+            pos, vel = self.step_bodies(self.bodies, pos, vel, mass, self.tick_time, self.dtype)
+            self.set_state(pos, vel)
+            if self.encounters is not None:
+                self.encounters.detect(self.bodies, start_pos, pos, self.time_passed, self.tick_time)
         self.time_passed += self.tick_time
-        for body in self.bodies:
-            body.update(self.tick_time)
+
+    def step_bodies(self, bodies, pos: np.ndarray, vel: np.ndarray, mass: np.ndarray, dt: float, dtype=np.float64) -> tuple:
+        '''
+            Returns the positions and velocities of the bodies after dt days with the settings of the space (see
+            kepler.step_bodies()), cluster by cluster if clusters is set
+        '''
+        if self.clusters is not None:
+            return self.clusters.step(bodies, pos, vel, mass, dt, self.integrator, dtype, self.solver,
+                                      self.light_mass_ratio)
+        return step_bodies(pos, vel, mass, dt, self.integrator, dtype, self.solver, self.light_mass_ratio)
+
+    def get_state(self) -> tuple:
+        '''
+            Returns the positions, velocities and masses of the bodies as (N,2), (N,2) and (N,) arrays
+        '''
+        state = Body.STORE.gather(self.get_rows())
+        mass = np.fromiter((body.mass for body in self.bodies), dtype=np.float64, count=len(self.bodies))
+        return np.ascontiguousarray(state[:,:2]), np.ascontiguousarray(state[:,2:]), mass
+
+    def set_state(self, pos: np.ndarray, vel: np.ndarray) -> None:
+        '''
+            Sets the positions and velocities of the bodies, they're written in the rows of the bodies in Body.STORE
+            so the views of them other objects (like the bodies menu) keep stay valid
+        '''
+        Body.STORE.scatter(self.get_rows(), np.hstack((pos, vel)))
+
+    def get_partition_error(self) -> tuple:
+        '''
+            Returns the largest error (relative to the largest acceleration) caused by treating the bodies lighter than
+            light_mass_ratio times the heaviest one as light, on the heavy bodies and on the light ones (see
+            physics.get_partition_error()). The bodies are split again at every step, so changing a mass (from the
+            planet ui or the bodies menu) moves the body to the right side on the next step
+        '''
+        pos, _, mass = self.get_state()
+        return get_partition_error(pos, mass, self.light_mass_ratio)
+
+    def get_rows(self) -> np.ndarray:
+        ''' Returns the row of each body in Body.STORE '''
+        return np.fromiter((body.row for body in self.bodies), dtype=np.int64, count=len(self.bodies))
+
+    def add_body(self, body: Body) -> None:
+        self.bodies.append(body)
+        if self.worker is not None:
+            self.worker.send_bodies()
+
+    def add_particles(self, pos: np.ndarray, vel=None) -> None:
+        ''' Adds test particles (see particles.py) with the given (N,2) positions and velocities '''
+        self.particles.add(pos, vel)
+        if self.worker is not None:
+            self.worker.send_bodies()
+
+    def add_ring(self, body: Body, inner: float, outer: float, count: int, seed=None) -> None:
+        '''
+            Adds count test particles on circular orbits around the body, between inner and outer pixels from its center
+        '''
+        self.particles.add_ring(body.pos.copy(), body.mass, inner, outer, count, body.vel.copy(), seed)
+        if self.worker is not None:
+            self.worker.send_bodies()
+
+    def start_worker(self, steps_per_second=30) -> None:
+        '''
+            Starts stepping the physics on a background thread, from now on sync() has to be called
+            every frame instead of update()
+        '''
+        if self.worker is None:
+            self.worker = PhysicsWorker(self, steps_per_second)
+            self.worker.start()
+
+    def stop_worker(self) -> None:
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+    def sync(self, paused=False) -> None:
+        '''
+            Sends the changes made to the bodies (by the gui) to the physics worker, and updates the bodies
+            with the latest state it published.\n
+            paused -> whether the worker should stop stepping the physics
+        '''
+        self.worker.paused = paused
+        self.worker.sync()
 
     def render(self, surf: pygame.Surface, W=800, H=600) -> None:
         if self.renders_field:
-            self.render_grav_field(surf, W, H)
+            if self.field_mode in ('arrows', 'adaptive'):
+                self.render_grav_field(surf, W, H)
+            else:
+                self.render_field_heatmap(surf, W, H)
+        self.particles.render(surf)
         
         for body in self.bodies:
             body.render(surf)
@@ -66,7 +287,8 @@ class Space:
         '''
         space_repr = "SPACE\n"
         space_repr += f"tick time:{self.tick_time}\nrenders field:{int(self.renders_field)}\n"
-        space_repr += f"margin:{int(self.margin)}\ntime passed:{self.time_passed}\n"
+        space_repr += f"margin:{int(self.margin)}\ntime passed:{self.time_passed}\nsolver:{self.solver}\n"
+        space_repr += f"light mass ratio:{self.light_mass_ratio}\nintegrator:{self.integrator}\n"
         return space_repr
 
     def highlight(self, bodies, unhighlight_others=True) -> None:
@@ -82,6 +304,8 @@ class Space:
         for body in bodies:
             if body in self.bodies:
                 self.bodies.remove(body)
+        if self.worker is not None:
+            self.worker.send_bodies()
 
     def get_highlighted(self) -> list:
         ''' Returns all the highlighted bodies '''
@@ -101,6 +325,9 @@ class Space:
         self.renders_field = bool(int(properties['renders field']))
         self.margin = int(properties['margin'])
         self.time_passed = float(properties['time passed'])
+        self.solver = properties.get('solver', 'direct') # the older saves don't have it
+        self.light_mass_ratio = float(properties.get('light mass ratio', self.LIGHT_MASS_RATIO))
+        self.integrator = properties.get('integrator', 'euler')
 
     def get_bodies_in_area(self, x, y, w, h):
         '''
@@ -120,32 +347,355 @@ class Space:
                 bodies.append(body)
         return bodies
 
-    def save(self, filename):
+    def get_save_snapshot(self) -> tuple:
+        '''
+            Returns a copy of everything that is saved, so that the space can be serialized on another thread
+        '''
+        self.finish_loading() # the bodies that haven't been loaded yet would be lost
+        return self.get_str_representation(), [body.get_save_state() for body in self.bodies]
+
+    @staticmethod
+    def iter_serialized(snapshot: tuple):
+        '''
+            Yields the content of the save file of the space the snapshot (see get_save_snapshot()) was taken from,
+            one block at a time
+        '''
+        space_repr, bodies = snapshot
+        yield space_repr+Space.SAVE_OBJECT_DELIMETER
+        for body in bodies:
+            yield Body.format_representation(*body)+Space.SAVE_OBJECT_DELIMETER
+
+    @staticmethod
+    def serialize(snapshot: tuple) -> str:
+        '''
+            Returns the content of the save file of the space the snapshot (see get_save_snapshot()) was taken from
+        '''
+        return ''.join(Space.iter_serialized(snapshot))
+
+    @staticmethod
+    def write_save(filename: str, content) -> None:
+        '''
+            Writes the save (either a string or an iterable of strings) to a temporary file which is then renamed,
+            so that a save is never left half-written. The save is compressed with SAVE_COMPRESSION as it's written
+        '''
         # if the saves folder isn't there create it
-        if 'saves' not in os.listdir(path):
-            os.mkdir(self.SAVES_PATH)
+        if not os.path.isdir(Space.SAVES_PATH):
+            os.mkdir(Space.SAVES_PATH)
+        if isinstance(content, str):
+            content = (content,)
+        compressor = None if Space.SAVE_COMPRESSION is None else get_compressor(Space.SAVE_COMPRESSION)
+        file_path = os.path.join(Space.SAVES_PATH, filename)
+        with open(file_path+'.tmp', 'wb') as file:
+            for block in content:
+                data = block.encode('utf-8')
+                file.write(data if compressor is None else compressor.compress(data))
+            if compressor is not None:
+                file.write(compressor.flush())
+        os.replace(file_path+'.tmp', file_path)
+
+    @staticmethod
+    def write_snapshot(filename: str, snapshot: tuple) -> None:
+        '''
+            Writes the save of the snapshot (see get_save_snapshot()) and updates the saves index, the spaces with
+            at least REGION_SAVE_MIN_BODIES bodies are written as region saves so that they can be loaded a region at a time
+        '''
+        space_repr, bodies = snapshot
+        if len(bodies) < Space.REGION_SAVE_MIN_BODIES:
+            Space.write_save(filename, Space.iter_serialized(snapshot))
+        else:
+            if not os.path.isdir(Space.SAVES_PATH):
+                os.mkdir(Space.SAVES_PATH)
+            file_path = os.path.join(Space.SAVES_PATH, filename)
+            RegionSave.write(file_path+'.tmp', space_repr, bodies)
+            os.replace(file_path+'.tmp', file_path)
+        update_saves_index(filename, Space.get_save_info(snapshot))
+
+    @staticmethod
+    def get_save_info(snapshot: tuple) -> dict:
+        '''
+            Returns the information about the save of the snapshot (see get_save_snapshot()) kept in the saves index
+        '''
+        space_repr, bodies = snapshot
+        properties = dict([line.split(':') for line in space_repr.split('\n')[1:-1]])
+        return {'bodies': len(bodies), 'time_passed': float(properties['time passed']),
+                'thumbnail': get_thumbnail((mass, pos, radius) for _, mass, pos, _, radius in bodies)}
+
+    @staticmethod
+    def rotate_saves(filename: str, count: int) -> None:
+        '''
+            Renames the saves "filename", "filename 1", ..., "filename {count-2}" to the next name in the sequence,
+            the save "filename {count-1}" (the oldest one) is overwritten
+        '''
+        names = [filename]+[f"{filename} {idx}" for idx in range(1, count)]
+        for idx in range(count-2, -1, -1):
+            old_path = os.path.join(Space.SAVES_PATH, names[idx])
+            if os.path.exists(old_path):
+                os.replace(old_path, os.path.join(Space.SAVES_PATH, names[idx+1]))
+
+    def save(self, filename):
         try:
-            file = open(os.path.join(self.SAVES_PATH, filename), 'w')
+            self.write_snapshot(filename, self.get_save_snapshot())
         except OSError:
             UIElement.popup_msg.cast("Invalid name!", 3, 0.4)
-            return
 
-        # actual saving
-        file.write(self.get_str_representation())
-        file.write(self.SAVE_OBJECT_DELIMETER)
-        for body in self.bodies:
-            file.write(body.get_str_representation())
-            file.write(self.SAVE_OBJECT_DELIMETER)
+    def save_async(self, filename, rotate=0):
+        '''
+            Saves the space on a background thread, only a copy of the state of the space is taken on the calling
+            thread. SPACE_SAVED_EVENT is posted when the save has been written (its success attribute is False if it
+            couldn't be).\n
+            rotate -> if it's not 0 the previous saves with the same name are rotated (see rotate_saves()) and this
+            many of them are kept
+        '''
+        snapshot = self.get_save_snapshot()
 
-        file.close()
-        
-    def load(self, filename):
-        file = open(os.path.join(self.SAVES_PATH, filename), 'r')
-        content = file.read().split(self.SAVE_OBJECT_DELIMETER)[:-1] # the last string is just empty
-        file.close()
-        self.load_from_representation(content[0])
+        def write():
+            try:
+                if rotate != 0:
+                    self.rotate_saves(filename, rotate)
+                self.write_snapshot(filename, snapshot)
+                success = True
+            except OSError:
+                success = False
+            if pygame.display.get_init(): # there's no event queue when running without the gui
+                pygame.event.post(pygame.event.Event(SPACE_SAVED_EVENT, space_name=filename, success=success))
+            return success
+
+        return self.SAVE_EXECUTOR.submit(write)
+
+    def check_autosave(self) -> None:
+        '''
+            Autosaves the space in the background every autosave_interval simulated days
+        '''
+        if self.autosave_interval is not None and self.time_passed-self.last_autosave >= self.autosave_interval:
+            self.last_autosave = self.time_passed
+            self.save_async(self.AUTOSAVE_NAME, rotate=self.MAX_AUTOSAVES)
+
+    def load(self, filename, view=None):
+        '''
+            view -> (x,y,w,h) region of the space that is shown, the bodies of region saves closest to it are loaded first
+        '''
+        file_path = os.path.join(self.SAVES_PATH, filename)
+        self.stop_loading()
+        if RegionSave.is_region_save(file_path):
+            self.load_regions(file_path, view)
+            return
+        blocks = iter_save_blocks(file_path)
+        self.load_from_representation(next(blocks))
+        self.last_autosave = self.time_passed
         self.bodies = []
-        for body_repr in content[1:]:
+        self.particles.clear()
+        for body_repr in blocks: # each body is parsed as soon as it's read
             new_body = Body((0,0),1)
             new_body.load_from_representation(body_repr)
-            self.bodies.append(new_body)
\ No newline at end of file
+            self.bodies.append(new_body)
+        if self.worker is not None:
+            self.worker.send_bodies()
+
+    def load_regions(self, file_path: str, view=None) -> None:
+        '''
+            Starts loading a region save: only the table of its cells is read here, the cells are read on a background
+            thread (starting from the ones closest to the view) and their bodies are added by poll_loading()
+        '''
+        reader = RegionReader(file_path)
+        self.load_from_representation(reader.space_repr)
+        self.last_autosave = self.time_passed
+        self.bodies = []
+        self.particles.clear()
+        if self.worker is not None:
+            self.worker.send_bodies() # the worker gets the loaded bodies once they've all been added (see poll_loading())
+        self.loading = reader.stream(view)
+        self.poll_loading()
+
+    def poll_loading(self, budget=None) -> bool:
+        '''
+            Adds the bodies of the region save being loaded that have been read so far, for at most budget seconds
+            (LOAD_BUDGET by default). Returns whether there are still bodies to add
+        '''
+        if self.loading is None:
+            return False
+        budget = self.LOAD_BUDGET if budget is None else budget
+        start = time.perf_counter()
+        while time.perf_counter()-start < budget:
+            if self.loading_cell is None:
+                try:
+                    cell = self.loading.queue.get(timeout=min(1, max(0, budget-(time.perf_counter()-start))))
+                except queue.Empty:
+                    continue
+                if cell is None: # every cell has been read
+                    self.loading = None
+                    break
+                self.loading_cell = [cell, 0]
+
+            cell, idx = self.loading_cell
+            body = Body(cell['pos'][idx], float(cell['mass'][idx]), name=cell['names'][idx])
+            body.set_vel(cell['vel'][idx])
+            body.set_radius(float(cell['radius'][idx]))
+            self.bodies.append(body)
+            self.loading_cell[1] += 1
+            if self.loading_cell[1] == len(cell['names']):
+                self.loading_cell = None
+        # the time is stopped while loading, so the worker only gets the bodies once (instead of every frame)
+        if self.loading is None and self.worker is not None:
+            self.worker.send_bodies()
+        return self.loading is not None
+
+    def finish_loading(self) -> None:
+        ''' Adds all the bodies of the region save being loaded that haven't been added yet '''
+        while self.poll_loading(budget=float('inf')):
+            pass
+
+    def stop_loading(self) -> None:
+        ''' Stops loading the region save being loaded, the bodies that have been added so far are kept '''
+        if self.loading is not None:
+            self.loading.stop()
+            if self.worker is not None:
+                self.worker.send_bodies()
+        self.loading = None
+        self.loading_cell = None
+
+    def is_loading(self) -> bool:
+        return self.loading is not None
+
+class PhysicsWorker:
+    '''
+        Steps the physics of a space on a background thread, so that a slow step doesn't freeze the input.\n
+        The worker keeps its own copy of the state of the bodies, which the main thread only changes by sending
+        commands, and after every step it publishes a read-only snapshot of it in a double buffer.
+    '''
+
+    def __init__(self, space: Space, steps_per_second=30) -> None:
+        self.space = space
+        self.steps_per_second = steps_per_second
+        self.paused = False
+        self.running = False
+        self.thread = None
+        self.commands = queue.Queue() # (seq, function, args), the functions are called on the worker's thread
+        self.seq = 0 # number of commands sent
+        self.snapshots = [None, None] # double buffer, the front one is the latest complete snapshot
+        self.front = 0
+        self.swap_lock = threading.Lock()
+        # state used by the worker's thread
+        self.bodies, self.pos, self.vel, self.mass = (), np.zeros((0,2)), np.zeros((0,2)), np.zeros(0)
+        self.particles = TestParticles()
+        self.time_passed = 0
+        self.handled_seq = 0 # seq of the last command handled
+        self.generation = 0 # generation of the last snapshot published
+        # state used by the main thread, indexed like the worker's list of bodies
+        self.synced = -1 # generation of the snapshot last written to the bodies
+        self.sent_bodies = () # the bodies last sent to the worker
+        self.rows = np.zeros(0, dtype=np.int64) # the row of each body in Body.STORE
+        self.written = np.zeros((0,4)) # (x, y, vx, vy) of each body last written to it or sent to the worker
+        self.written_mass = np.zeros(0) # mass of each body last sent to the worker
+        self.pending = np.zeros(0, dtype=np.int64) # seq of the last command that changed each body
+        self.bodies_seq = 0 # seq of the last command that replaced the list of bodies
+        self.send_bodies()
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def send(self, function, *args) -> int:
+        '''
+            Sends a command to the worker and returns its sequence number, the function is called
+            with the given arguments on the worker's thread before the next step
+        '''
+        self.seq += 1
+        self.commands.put((self.seq, function, args))
+        return self.seq
+
+    def send_bodies(self) -> None:
+        ''' Replaces the whole state of the worker with the one of the bodies in the space '''
+        pos, vel, mass = self.space.get_state()
+        bodies = tuple(self.space.bodies)
+        dtype = self.space.dtype # the worker keeps the state with the precision of the space
+        self.bodies_seq = self.send(self._set_bodies, bodies, pos.astype(dtype), vel.astype(dtype), mass.astype(dtype),
+                                    self.space.particles.get_state().astype(dtype), self.space.time_passed)
+        self.sent_bodies = bodies
+        self.rows = self.space.get_rows()
+        self.written = np.hstack((pos, vel))
+        self.written_mass = mass
+        self.pending = np.zeros(len(bodies), dtype=np.int64)
+
+    def sync(self) -> None:
+        '''
+            Called by the main thread every frame, see Space.sync()
+        '''
+        # send the changes the gui made to the bodies (dragging them, changing their mass and so on)
+        state = Body.STORE.gather(self.rows)
+        mass = np.fromiter((body.mass for body in self.sent_bodies), dtype=np.float64, count=len(self.rows))
+        changed = np.flatnonzero((state != self.written).any(axis=1) | (mass != self.written_mass))
+        if len(changed) != 0:
+            self.written[changed] = state[changed]
+            self.written_mass[changed] = mass[changed]
+            self.pending[changed] = self.send(self._set_rows, changed, state[changed,:2], state[changed,2:], mass[changed])
+
+        snapshot = self.get_snapshot()
+        if snapshot is None or snapshot.generation == self.synced or snapshot.seq < self.bodies_seq:
+            return
+        # the bodies changed after the snapshot was taken are skipped, one of the next snapshots will include the change
+        synced = np.flatnonzero(self.pending <= snapshot.seq)
+        values = np.hstack((snapshot.pos[synced], snapshot.vel[synced]))
+        Body.STORE.scatter(self.rows[synced], values)
+        self.written[synced] = values
+        self.space.particles.set_state(snapshot.particles)
+        self.space.time_passed = snapshot.time_passed
+        self.synced = snapshot.generation
+
+    def get_snapshot(self) -> SpaceSnapshot:
+        with self.swap_lock:
+            return self.snapshots[self.front]
+
+    # METHODS CALLED ON THE WORKER'S THREAD
+
+    def _set_bodies(self, bodies, pos, vel, mass, particles, time_passed) -> None:
+        self.bodies, self.pos, self.vel, self.mass = bodies, pos, vel, mass
+        self.particles = TestParticles(particles.dtype)
+        self.particles.add(particles[:,:2], particles[:,2:])
+        self.time_passed = time_passed
+
+    def _set_rows(self, indices, pos, vel, mass) -> None:
+        ''' Sets the state of the bodies with the given indices '''
+        self.pos[indices] = pos
+        self.vel[indices] = vel
+        self.mass[indices] = mass
+
+    def _publish(self) -> None:
+        pos, vel, particles = self.pos.copy(), self.vel.copy(), self.particles.get_state()
+        pos.flags.writeable = False
+        vel.flags.writeable = False
+        particles.flags.writeable = False
+        back = 1-self.front
+        self.generation += 1
+        self.snapshots[back] = SpaceSnapshot(self.bodies, pos, vel, particles, self.time_passed, self.handled_seq,
+                                             self.generation)
+        with self.swap_lock:
+            self.front = back
+
+    def _run(self) -> None:
+        while self.running:
+            start = time.perf_counter()
+            changed = not self.commands.empty()
+            while not self.commands.empty():
+                self.handled_seq, function, args = self.commands.get()
+                function(*args)
+
+            if not self.paused:
+                changed = True
+                tick_time = self.space.tick_time
+                self.particles.step(self.pos, self.mass, tick_time)
+                if len(self.bodies) != 0:
+                    dtype = self.pos.dtype.type
+                    pos, vel = self.space.step_bodies(self.bodies, self.pos, self.vel, self.mass, tick_time, dtype)
+                    start_pos, self.pos, self.vel = self.pos, pos.astype(dtype, copy=False), vel.astype(dtype, copy=False)
+                    if self.space.encounters is not None:
+                        self.space.encounters.detect(self.bodies, start_pos, self.pos, self.time_passed, tick_time)
+                self.time_passed += tick_time
+            if changed: # while paused a snapshot is only published after a command
+                self._publish()
+            time.sleep(max(0, 1/self.steps_per_second-(time.perf_counter()-start)))
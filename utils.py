@@ -1,6 +1,18 @@
 import pygame
 import numpy as np
 import os
+import threading
+import codecs
+import heapq
+import json
+import zlib
+import lzma
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import zstandard
+except ImportError: # optional, saves are compressed with zlib without it
+    zstandard = None
+from regions import RegionSave, RegionReader
 
 arrow_vertices = np.array(((-40.5, -6.5), (-40.5, 6.5), (13.5, 6.5), (13.5, 19.5), (40.5, 0), (13.5, -19.5), (13.5, -6.5)))
 
@@ -13,6 +25,9 @@ elif __file__:
 
 res_path = os.path.join(path, 'res')
 saves_path = os.path.join(path, 'saves')
+SAVE_DELIMETER = "-"*20+"\n" # the delimeter between one thing and another in a save file
+SAVES_INDEX_NAME = '.index' # the file in the saves folder with the cached information about each save
+THUMBNAIL_BODIES = 64 # maximum amount of bodies (the most massive ones) in the thumbnail of a save
 
 def rotate(x: np.ndarray, angle: float) -> np.ndarray:
     '''
@@ -22,16 +37,138 @@ def rotate(x: np.ndarray, angle: float) -> np.ndarray:
                             [np.math.sin(angle), np.math.cos(angle)]])
     return x@rotation_mat
 
-def draw_vector(surf: pygame.Surface, vector: np.ndarray, scale: float, pos) -> None:
+class ArrowAtlas:
     '''
-        Draws the vector vector on the surface surf with a length of scale in the (x,y) position pos
+        The arrows of the vectors (the polygon arrow_vertices, scaled by the log of their length) pre-rendered at
+        ANGLES angles and at scales rounded to SCALE_STEP, so that a lot of them can be drawn with a single
+        Surface.blits() call. Each arrow is only rendered the first time it's needed
     '''
-    global arrow_vertices
-    angle = get_angle((vector[0], vector[1])) # the y component is flipped because of pygame's coordinate system
-    poly = arrow_vertices*min(np.log(scale*2+1),30) # scale the polygon based on gravitational force
-    poly = rotate(poly, angle) # apply the correct rotation
-    poly += pos # translate to the right position
-    pygame.draw.polygon(surf, (255,255,255), poly)
+    ANGLES = 72
+    SCALE_STEP = 0.05 # the scale of the polygon of the arrows is rounded to a multiple of it
+    COLOR = (255,255,255)
+
+    def __init__(self) -> None:
+        self.sprites = {} # (angle index, scale index) -> surface with the arrow centered in it
+
+    def get_sprite(self, angle_idx: int, scale_idx: int) -> pygame.Surface:
+        key = (angle_idx, scale_idx)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            poly = rotate(arrow_vertices*scale_idx*self.SCALE_STEP, angle_idx*2*np.pi/self.ANGLES)
+            half = int(np.ceil(np.abs(poly).max()))+1
+            sprite = pygame.Surface((2*half, 2*half), pygame.SRCALPHA)
+            pygame.draw.polygon(sprite, self.COLOR, poly+half)
+            if pygame.display.get_surface() is not None:
+                sprite = sprite.convert_alpha()
+            self.sprites[key] = sprite
+        return sprite
+
+    def get_blits(self, vectors: np.ndarray, scales: np.ndarray, positions: np.ndarray) -> list:
+        '''
+            Returns the (sprite, position) pairs to pass to Surface.blits() to draw the arrows.\n
+            vectors -> (N,2) array with the vectors the arrows point along\n
+            scales -> (N,) array with the length of each arrow, the polygon is scaled by log(2*scale+1) up to 30\n
+            positions -> (N,2) array with the position of the center of each arrow
+        '''
+        # same angles as get_angle(), with the y axis flipped because of pygame's coordinate system
+        angles = np.arctan2(-vectors[:,1], vectors[:,0])
+        angle_idx = np.round(angles/(2*np.pi)*self.ANGLES).astype(np.int64) % self.ANGLES
+        scale_idx = np.round(np.minimum(np.log(scales*2+1), 30)/self.SCALE_STEP).astype(np.int64)
+        positions = np.round(positions).astype(np.int64)
+        blits = []
+        for angle, scale, (x, y) in zip(angle_idx.tolist(), scale_idx.tolist(), positions.tolist()):
+            sprite = self.get_sprite(angle, scale)
+            half = sprite.get_width()//2
+            blits.append((sprite, (x-half, y-half)))
+        return blits
+
+    def draw(self, surf: pygame.Surface, vector: np.ndarray, scale: float, pos) -> None:
+        ''' Draws the arrow of the vector on the surface surf with a length of scale in the (x,y) position pos '''
+        surf.blits(self.get_blits(np.array((vector,), dtype=np.float64), np.array((scale,)), np.array((pos,))), False)
+
+ARROW_ATLAS = ArrowAtlas() # shared by the gravitational field and the velocities of the bodies
+
+HEATMAP_COLORS = np.array(((0,0,0), (40,0,90), (150,20,120), (240,90,40), (255,220,90), (255,255,255)), dtype=np.float64)
+
+def apply_colormap(values: np.ndarray, colors=HEATMAP_COLORS) -> np.ndarray:
+    '''
+        Returns the (..., 3) uint8 array with the color of each of the values (between 0 and 1), the colors are
+        interpolated between the ones in colors (the first one is for 0 and the last one for 1)
+    '''
+    stops = np.linspace(0, 1, len(colors))
+    rgb = np.empty(values.shape+(3,), dtype=np.uint8)
+    for channel in range(3):
+        rgb[...,channel] = np.interp(values, stops, colors[:,channel])
+    return rgb
+
+# for each marching squares case (a bit for each corner above the level: (0,0), (1,0), (1,1), (0,1)) the edges
+# the contour segments go between: 0 -> y=0, 1 -> x=1, 2 -> y=1, 3 -> x=0, -1 if there's no segment
+_CONTOUR_EDGES = np.array([
+    [[-1,-1], [-1,-1]], [[3,0], [-1,-1]], [[0,1], [-1,-1]], [[3,1], [-1,-1]],
+    [[1,2], [-1,-1]], [[3,0], [1,2]], [[0,2], [-1,-1]], [[3,2], [-1,-1]],
+    [[2,3], [-1,-1]], [[2,0], [-1,-1]], [[0,1], [2,3]], [[2,1], [-1,-1]],
+    [[1,3], [-1,-1]], [[1,0], [-1,-1]], [[0,3], [-1,-1]], [[-1,-1], [-1,-1]]])
+
+def get_contour_segments(values: np.ndarray, level: float) -> np.ndarray:
+    '''
+        Returns the (S,2,2) array with the segments of the contour line of the 2d grid of values at the given level,
+        found with marching squares on every cell at once. The points are in grid coordinates (x along the first axis)
+    '''
+    corners = (values[:-1,:-1], values[1:,:-1], values[1:,1:], values[:-1,1:])
+    case = sum((corner > level).astype(np.int64) << bit for bit, corner in enumerate(corners))
+    # only the cells the contour goes through are looked at
+    x, y = np.nonzero((case != 0) & (case != 15))
+    case = case[x, y]
+    corners = [corner[x, y] for corner in corners]
+    t = [(level-corners[idx])/(corners[(idx+1)%4]-corners[idx]) for idx in range(4)]
+    # point where the contour crosses each edge of the cells (the edges without a crossing aren't used)
+    points = np.stack([np.stack((x+t[0], y), -1), np.stack((x+1, y+t[1]), -1),
+                       np.stack((x+1-t[2], y+1), -1), np.stack((x, y+1-t[3]), -1)])
+    segments = []
+    for slot in range(2):
+        edges = _CONTOUR_EDGES[case, slot]
+        cells = np.flatnonzero(edges[:,0] >= 0)
+        segments.append(np.stack((points[edges[cells,0], cells], points[edges[cells,1], cells]), 1))
+    return np.concatenate(segments)
+
+_images = {} # name of the file in the res folder -> loaded image
+_converted = set() # names of the images already converted to the pixel format of the display
+_spritesheets = {} # (name, tile_w, tile_h) -> (image the tiles were taken from, list of tiles)
+_images_lock = threading.Lock()
+
+def load_image(source: str) -> pygame.Surface:
+    '''
+        Returns the image with the given name in the res folder, it's only read from the disk the first time it's
+        requested, and converted to the pixel format of the display once the display has been created.\n
+        The returned surface is shared, so it shouldn't be drawn on
+    '''
+    with _images_lock:
+        img = _images.get(source)
+        if img is None:
+            img = pygame.image.load(os.path.join(res_path, source))
+        if source not in _converted and pygame.display.get_surface() is not None:
+            img = img.convert_alpha()
+            _converted.add(source)
+        _images[source] = img
+    return img
+
+def preload_images(sources=None) -> threading.Thread:
+    '''
+        Starts loading the given images (every image in the res folder if sources is None) on a background
+        thread and returns it, the images are then converted on their first use
+    '''
+    if sources is None:
+        sources = [name for name in os.listdir(res_path) if name.endswith('.png')]
+
+    def load_all():
+        for source in sources:
+            with _images_lock:
+                if source not in _images:
+                    _images[source] = pygame.image.load(os.path.join(res_path, source))
+
+    thread = threading.Thread(target=load_all, daemon=True)
+    thread.start()
+    return thread
 
 def load_spritesheet(source, tile_w=32, tile_h=32, new_size=None):
     '''
@@ -41,8 +178,16 @@ def load_spritesheet(source, tile_w=32, tile_h=32, new_size=None):
         new_size -> the size to which each image is scaled after it's loaded
     '''
     if isinstance(source, str):
-        source = pygame.image.load(os.path.join(res_path, source))
-    
+        img = load_image(source)
+        cached = _spritesheets.get((source, tile_w, tile_h))
+        # the tiles have to be taken again if the image was converted since they were cached
+        if cached is None or cached[0] is not img:
+            cached = (img, load_spritesheet(img, tile_w, tile_h))
+            _spritesheets[(source, tile_w, tile_h)] = cached
+        if new_size is None:
+            return list(cached[1])
+        return [pygame.transform.scale(texture, new_size) for texture in cached[1]]
+
     textures = []
     num_x_tiles = source.get_width()//tile_w # number of tiles horizontally
     num_y_tiles = source.get_height()//tile_h # number of tiles vertically
@@ -54,7 +199,7 @@ def load_spritesheet(source, tile_w=32, tile_h=32, new_size=None):
     return textures
 
 def load_texture(source: str, size=None) -> pygame.Surface:
-    img = pygame.image.load(os.path.join(res_path, source))
+    img = load_image(source)
     if size is not None:
         img = pygame.transform.scale(img, size)
     return img
@@ -153,19 +298,191 @@ def aconvert(angle: float, rad_to_deg=True) -> int:
     rad_angle += -2*np.pi if rad_angle > np.pi else 0
     return rad_angle
 
+_saves_index = None # {'dir_mtime': mtime of the saves folder, 'saves': {name: information about the save}}
+_saves_index_lock = threading.RLock() # the saves are written on a background thread
+_save_info_executor = None # reads the saves missing from the index, it's only started the first time it's needed
+
+def _get_saves_index() -> dict:
+    global _saves_index
+    if _saves_index is None:
+        try:
+            with open(os.path.join(saves_path, SAVES_INDEX_NAME), 'r') as file:
+                _saves_index = json.load(file)
+        except (OSError, ValueError): # there's no index yet, or it's corrupted
+            _saves_index = {'dir_mtime': None, 'saves': {}}
+    return _saves_index
+
+def _write_saves_index() -> None:
+    '''
+        Lists the saves folder again (keeping the information about the saves that are still there), writes the index
+        in it and stores the mtime the folder has after the index is written
+    '''
+    index_path = os.path.join(saves_path, SAVES_INDEX_NAME)
+    # the temporary files are the saves being written
+    names = [name for name in os.listdir(saves_path) if not name.endswith('.tmp') and name != SAVES_INDEX_NAME]
+    _saves_index['saves'] = {name: _saves_index['saves'].get(name) for name in sorted(names)}
+    for _ in range(2): # creating the index changes the mtime of the folder, so it has to be written again
+        with open(index_path, 'w') as file:
+            json.dump(_saves_index, file)
+        dir_mtime = os.stat(saves_path).st_mtime_ns
+        if dir_mtime == _saves_index['dir_mtime']:
+            break
+        _saves_index['dir_mtime'] = dir_mtime
+
 def get_saves() -> list:
     '''
-        Returns a list with the names of all the saved spaces in the respective folder, excluding the
-        automatically saved space
+        Returns a list with the names of all the saved spaces in the respective folder, the folder is only
+        listed again if it has been modified since the last time
+    '''
+    with _saves_index_lock:
+        index = _get_saves_index()
+        if index['dir_mtime'] != os.stat(saves_path).st_mtime_ns:
+            _write_saves_index()
+        return list(index['saves'])
+
+def get_save_info(name: str) -> dict:
+    '''
+        Returns the information about the save with the given name as a dictionary with its number of bodies ('bodies'),
+        the days passed in it ('time_passed'), the size of its file ('size') and its thumbnail ('thumbnail', see
+        get_thumbnail()). The information is cached in the saves index, and only read from the save if the save has
+        been modified since (the index isn't locked meanwhile, see request_save_info())
+    '''
+    info = get_cached_save_info(name)
+    if info is None:
+        stat = os.stat(os.path.join(saves_path, name))
+        info = read_save_info(os.path.join(saves_path, name))
+        info.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        with _saves_index_lock:
+            _get_saves_index()['saves'][name] = info
+            _write_saves_index()
+    return info
+
+def get_cached_save_info(name: str) -> dict:
+    '''
+        Returns the information about the save with the given name (see get_save_info()) if the saves index has it
+        and the save hasn't been modified since, None otherwise. The save itself is never read
+    '''
+    with _saves_index_lock:
+        stat = os.stat(os.path.join(saves_path, name))
+        info = _get_saves_index()['saves'].get(name)
+        return info if info is not None and info['mtime'] == stat.st_mtime_ns else None
+
+def request_save_info(name: str):
+    '''
+        Returns a Future with the information about the save with the given name (see get_save_info()), it's read
+        on a background thread since reading a whole save (like every cell of a region save) takes a while
+    '''
+    global _save_info_executor
+    with _saves_index_lock:
+        if _save_info_executor is None:
+            _save_info_executor = ThreadPoolExecutor(max_workers=1)
+    return _save_info_executor.submit(get_save_info, name)
+
+def update_saves_index(name: str, info: dict) -> None:
+    '''
+        Stores the information (without the size and the mtime, which are taken from the file) about a save that
+        was just written in the saves index
+    '''
+    with _saves_index_lock:
+        stat = os.stat(os.path.join(saves_path, name))
+        _get_saves_index()['saves'][name] = dict(info, mtime=stat.st_mtime_ns, size=stat.st_size)
+        _write_saves_index()
+
+def read_save_info(file_path: str) -> dict:
+    '''
+        Reads the information kept in the saves index (see get_save_info()) from a save file
+    '''
+    if RegionSave.is_region_save(file_path):
+        reader = RegionReader(file_path)
+        time_passed = float(reader.space_repr.split('time passed:')[1].split('\n')[0])
+        bodies = reader.read_cells(range(len(reader.cells)))
+        return {'bodies': reader.num_bodies, 'time_passed': time_passed,
+                'thumbnail': get_thumbnail(zip(bodies['mass'], bodies['pos'], bodies['radius']))}
+    blocks = iter_save_blocks(file_path)
+    time_passed = float(next(blocks).split('time passed:')[1].split('\n')[0])
+    num_bodies, bodies = 0, []
+    for block in blocks:
+        num_bodies += 1
+        properties = dict([line.split(':') for line in block.split('\n')[1:-1]])
+        pos = properties['pos'].replace('(','').replace(')','').split(', ')
+        bodies.append((float(properties['mass']), (float(pos[0]), float(pos[1])), float(properties['radius'])))
+    return {'bodies': num_bodies, 'time_passed': time_passed, 'thumbnail': get_thumbnail(bodies)}
+
+def get_thumbnail(bodies) -> list:
+    '''
+        Returns the thumbnail of a save, which is a list of [x, y, radius] of its THUMBNAIL_BODIES most massive
+        bodies, bodies is an iterable of (mass, (x,y), radius)
+    '''
+    largest = heapq.nlargest(THUMBNAIL_BODIES, bodies, key=lambda body: body[0])
+    return [[round(pos[0]), round(pos[1]), round(radius)] for _, pos, radius in largest]
+
+ZSTD_MAGIC, LZMA_MAGIC, ZLIB_MAGIC = b'\x28\xb5\x2f\xfd', b'\xfd7zXZ\x00', b'\x78'
+DEFAULT_COMPRESSION = 'zstd' if zstandard is not None else 'zlib'
+
+def get_compressor(method: str):
+    '''
+        Returns a streaming compressor (with a compress(data) and a flush() method) for the given method,
+        which can be 'zstd', 'lzma' or 'zlib'
+    '''
+    if method == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor().compressobj()
+    elif method == 'lzma':
+        return lzma.LZMACompressor()
+    elif method == 'zlib':
+        return zlib.compressobj()
+    raise ValueError(f"Unknown compression method: {method}")
+
+def get_decompressor(header: bytes):
+    '''
+        Returns a streaming decompressor (with a decompress(data) method) for data starting with the given
+        header, None if the data isn't compressed
+    '''
+    if header.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("zstd compressed files need the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif header.startswith(LZMA_MAGIC):
+        return lzma.LZMADecompressor()
+    elif header.startswith(ZLIB_MAGIC):
+        return zlib.decompressobj()
+    return None
+
+def iter_file_chunks(file_path: str, chunk_size=1 << 16):
+    '''
+        Yields the content of the file (decompressed if it's compressed) in chunks of bytes
+    '''
+    with open(file_path, 'rb') as file:
+        chunk = file.read(chunk_size)
+        decompressor = get_decompressor(chunk)
+        while len(chunk) != 0:
+            yield chunk if decompressor is None else decompressor.decompress(chunk)
+            chunk = file.read(chunk_size)
+        if hasattr(decompressor, 'flush'):
+            yield decompressor.flush()
+
+def iter_save_blocks(file_path: str):
+    '''
+        Yields the blocks of a save file (the space first, and then each body) as soon as they're read and
+        decompressed, without reading the whole file first
     '''
-    saves = os.listdir(saves_path)
-    return saves
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = "" # the last block, which hasn't been completely read yet
+    for chunk in iter_file_chunks(file_path):
+        pending = (pending+decoder.decode(chunk)).replace('\r\n', '\n') # saves written on windows
+        blocks = pending.split(SAVE_DELIMETER)
+        pending = blocks.pop()
+        yield from blocks
 
 def del_save(name: str) -> None:
     '''
         Deletes the saved space with the given name
     '''
     os.remove(os.path.join(saves_path, name))
+    with _saves_index_lock:
+        _get_saves_index()['saves'].pop(name, None)
+        _write_saves_index()
 
 def rotate_texture(texture: pygame.Surface, angle: float, topleft_pos=(0,0)):
     '''
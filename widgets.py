@@ -1,42 +1,87 @@
 import pygame
+import re
 import time
+from collections import OrderedDict
 from utils import adapt_ratio, load_texture, clamp, load_spritesheet, rotate_texture, get_angle
 
 class UI:
+    POINTER_EVENTS = (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+    KEYBOARD_EVENTS = (pygame.KEYDOWN, pygame.KEYUP)
 
     def __init__(self) -> None:
-        self.widgets = []
+        self.widgets = [] # ordered from the bottom-most to the top-most (the order in which they're rendered)
         self.enabled = True
+        self.hit_map = None # list of (rect, widget) of the enabled widgets, from the top-most to the bottom-most
+        self.hovered = None # the widget the mouse was last on
+        self.pressed = None # the widget on which the left click was pressed, it receives the release as well
 
     def handle_event(self, event, mouse_pos=None, mouse_vel=None) -> None:
         '''
             Handles the pygame event event.\n
+            Pointer events are only delivered to the top-most widget under the mouse and to the ones that captured
+            the pointer, keyboard events only to the focused textbox.\n
             mouse_pos -> position of the mouse.\\
             mouse_vel -> displacement of the mouse from the last tick (in pixels).
         '''
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            mouse_pos = mouse_pos if mouse_pos is not None else pygame.mouse.get_pos()       
+        if event.type in self.KEYBOARD_EVENTS:
+            focused = TextBox.focused
+            if focused is not None and focused.active and focused.is_shown():
+                focused.handle_event(event)
+            return
+        if event.type not in self.POINTER_EVENTS or (event.type != pygame.MOUSEMOTION and event.button != 1):
             for widget in self.widgets:
-                widget.on_click(mouse_pos)
+                widget.handle_event(event, mouse_pos)
+            return
 
-        elif event.type == pygame.MOUSEMOTION:
-            mouse_pos = mouse_pos if mouse_pos is not None else pygame.mouse.get_pos()
-            for widget in self.widgets:
-                widget.on_mouse_motion(mouse_pos)
+        mouse_pos = mouse_pos if mouse_pos is not None else pygame.mouse.get_pos()
+        hit = self.get_hit_widget(mouse_pos)
+        targets = [hit]
+        if event.type == pygame.MOUSEMOTION:
+            targets.append(self.hovered) # the widget the mouse just left has to know (for example to stop being highlighted)
+            self.hovered = hit
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            self.pressed = hit
+        else:
+            targets.append(self.pressed)
+            self.pressed = None
 
-        elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
-            mouse_pos = mouse_pos if mouse_pos is not None else pygame.mouse.get_pos()
-            for widget in self.widgets:
+        # keep the order in which the widgets would have handled the event if it was delivered to all of them
+        for widget in self.widgets:
+            if widget not in targets and not widget.captures_pointer():
+                continue
+            if event.type == pygame.MOUSEMOTION:
+                widget.on_mouse_motion(mouse_pos)
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                widget.on_click(mouse_pos)
+            else:
                 widget.on_click_release(mouse_pos, mouse_vel)
-        else:
-            for widget in self.widgets:
-                widget.handle_event(event, mouse_pos)
+
+        # clicks can enable, disable or move widgets
+        if event.type != pygame.MOUSEMOTION:
+            self.hit_map = None
+
+    def get_hit_widget(self, pos: tuple):
+        '''
+            Returns the top-most enabled widget whose bounding box contains the (x,y) position pos,
+            None if there isn't one
+        '''
+        if self.hit_map is None:
+            self.hit_map = []
+            for widget in reversed(self.widgets):
+                rect = widget.get_bounding_box() if widget.enabled else None
+                if rect is not None:
+                    self.hit_map.append((rect, widget))
+        for rect, widget in self.hit_map:
+            if rect.collidepoint(pos):
+                return widget
+        return None
 
     def update(self):
         for widget in self.widgets:
             widget.update()
 
     def render(self, surf):
+        self.hit_map = None # the widgets might have been moved or resized since the last frame
         if not self.enabled:
             return
 
@@ -50,6 +95,7 @@ class UI:
 
     def add_widget(self, widget) -> None:
         self.widgets.append(widget)
+        self.hit_map = None
 
     def get_by_type(self, _type: type):
         '''
@@ -70,8 +116,87 @@ class UI:
                 return True
         return False
 
+class TextCache:
+    '''
+        LRU cache of the text surfaces rendered by the font, it's shared by every text widget.\n
+        The numbers in a string (the runs of GLYPH_CHARS, which change every tick in the readouts) are composed
+        from the cached surface of each of their characters, and the labels around them (like "Days passed: ")
+        are rendered by the font once and cached on their own
+    '''
+    MAX_SIZE = 256 # maximum amount of strings (and of labels) kept in the cache
+    GLYPH_CHARS = "0123456789.,-+*^()"
+    NUMBERS = re.compile('([' + re.escape(GLYPH_CHARS) + ']+)') # splits a string in labels and numbers
+
+    def __init__(self, font, max_size=MAX_SIZE) -> None:
+        self.font = font
+        self.max_size = max_size
+        self.surfaces = OrderedDict() # (text, color) -> surface, ordered from the least to the most recently used
+        self.labels = OrderedDict() # (label, color) -> surface, ordered like surfaces
+        self.glyphs = {} # (char, color) -> surface
+
+    def render(self, text: str, color=(255,255,255)) -> pygame.Surface:
+        '''
+            Returns the surface with the given text rendered in the given color, the surface is shared
+            so it shouldn't be modified (scaling it returns a new one, so that's fine)
+        '''
+        key = (text, color)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            return surf
+
+        parts = self.NUMBERS.split(text) # labels at the even indices, numbers at the odd ones
+        if len(parts) > 1:
+            surf = self._compose(parts, color)
+        else:
+            surf = self.font.render(text, False, color)
+        if pygame.display.get_surface() is not None:
+            surf = surf.convert_alpha() # the font renders 8-bit surfaces, which would be converted at every blit
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False) # drop the least recently used string
+        return surf
+
+    def _get_glyph(self, char: str, color) -> pygame.Surface:
+        glyph = self.glyphs.get((char, color))
+        if glyph is None:
+            glyph = self.font.render(char, False, color)
+            self.glyphs[(char, color)] = glyph
+        return glyph
+
+    def _get_label(self, label: str, color) -> pygame.Surface:
+        key = (label, color)
+        surf = self.labels.get(key)
+        if surf is None:
+            surf = self.font.render(label, False, color)
+            self.labels[key] = surf
+            if len(self.labels) > self.max_size:
+                self.labels.popitem(last=False)
+        else:
+            self.labels.move_to_end(key)
+        return surf
+
+    def _compose(self, parts: list, color) -> pygame.Surface:
+        '''
+            Builds the surface of the text by placing the surface of each label and the glyph of each character
+            of the numbers one after the other
+        '''
+        glyphs = []
+        for idx, part in enumerate(parts):
+            if idx % 2 == 1:
+                glyphs.extend(self._get_glyph(char, color) for char in part)
+            elif len(part) != 0:
+                glyphs.append(self._get_label(part, color))
+        surf = pygame.Surface((sum(glyph.get_width() for glyph in glyphs), self.font.get_height()), pygame.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            surf.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return surf
+
 class UIElement:
     font = None
+    text_cache = None # rendered text shared by every widget
     popup_msg = None # pop up text
 
     # make a list of children GUIelements, so that their position and whether they
@@ -102,6 +227,19 @@ class UIElement:
                 return True
         return False
 
+    def captures_pointer(self) -> bool:
+        '''
+            Returns whether the widget has to receive the pointer events even when they happen outside of it
+            (for example while something is being dragged)
+        '''
+        return False
+
+    def is_shown(self) -> bool:
+        '''
+            Returns whether the widget and all of its parents are enabled
+        '''
+        return self.enabled and (self.parent is None or self.parent.is_shown())
+
     def on_mouse_motion(self, *args) -> None: pass
     def on_click_release(self, *args): pass
     def handle_event(self, *args) -> None: pass
@@ -142,15 +280,42 @@ class UIElement:
         parent_pos = self.get_parent_pos()
         return (pos[0]+parent_pos[0], pos[1]+parent_pos[1])
 
-    def get_child_widgets(self) -> None:
-        widgets = []
-        for attrib in dir(self):
-            # do not account for the attributes every element has
-            if attrib == 'parent' or attrib == 'popup_msg':
+    def __setattr__(self, name, value) -> None:
+        '''
+            Keeps the registry of the children widgets up to date whenever an attribute is set, a child
+            widget is any attribute that is itself a UIElement (except for the parent)
+        '''
+        super().__setattr__(name, value)
+        if name == 'parent' or name == '_children':
+            return
+        children = self.__dict__.setdefault('_children', {})
+        if isinstance(value, UIElement):
+            children[name] = value
+        elif name in children: # the child widget was replaced by something else
+            del children[name]
+
+    def get_child_widgets(self) -> list:
+        '''
+            Returns the children widgets, sorted by the name of the attribute they're stored in
+        '''
+        children = self.__dict__.get('_children', {})
+        return [children[name] for name in sorted(children)]
+
+    def get_bounding_box(self) -> pygame.Rect:
+        '''
+            Returns the rect (in absolute coordinates) that contains the widget and all of its enabled children,
+            None if the widget has no size and no enabled children
+        '''
+        rect = None
+        if self.size[0] != 0 and self.size[1] != 0:
+            rect = pygame.Rect(self.get_abs_pos(), self.size)
+        for widget in self.get_child_widgets():
+            if not widget.enabled:
                 continue
-            if isinstance(self.__getattribute__(attrib), UIElement):
-                widgets.append(self.__getattribute__(attrib))
-        return widgets
+            child_rect = widget.get_bounding_box()
+            if child_rect is not None:
+                rect = child_rect if rect is None else rect.union(child_rect)
+        return rect
 
     @staticmethod
     def init(W=800, H=600.0) -> None:
@@ -160,6 +325,7 @@ class UIElement:
         '''
    #     font_location = pygame.font.match_font('arial')
         UIElement.font = pygame.font.SysFont(None, int(23*(W+H)/1400.0))
+        UIElement.text_cache = TextCache(UIElement.font) # the old surfaces were rendered with the old font size
         pop_up_size = adapt_ratio((128,32), (W/800.0, H/600.0))
         UIElement.popup_msg = PopUpText(((W-pop_up_size[0])//2, int(100*H/600)), pop_up_size)
 
@@ -248,7 +414,8 @@ class ProgressBar(UIElement):
             surf.blit(self.texture, self.get_abs_pos(self.pos))
 
 class TextBox(UIElement):
-    DEFAULT_TEXTURE = load_texture('textbox.png')
+    DEFAULT_TEXTURE = 'textbox.png'
+    focused = None # the textbox that was last activated, the keyboard events are only sent to it
     # characters that can't be typed in
     FORBIDDEN_CHARS = (8, pygame.K_ESCAPE, pygame.K_RETURN)
     # characters that can be typed in numeric mode even if they aren't numbers
@@ -268,7 +435,7 @@ class TextBox(UIElement):
         '''
         super().__init__(pos, size, texture=texture if texture is not None else self.DEFAULT_TEXTURE, parent=parent, enabled=not enable_on_click)
         self.content = ""
-        self.text = self.font.render("", False, (255,255,255))
+        self.text = self.text_cache.render("")
         self.max_len = max(1, max_len)
         self.char_size = (int(self.size[0]/self.max_len*letter_width), int(self.size[1]*3/5))
         self.letter_width = letter_width
@@ -290,7 +457,7 @@ class TextBox(UIElement):
         if len(text) > self.max_len:
             self.set_max_len(len(text))
         text_size = (int(self.char_size[0]*len(self.content)), int(self.char_size[1]))
-        self.text = pygame.transform.scale(self.font.render(self.content, False, (255,255,255)), text_size) # the text has to be re-rendered
+        self.text = pygame.transform.scale(self.text_cache.render(self.content), text_size) # the text has to be re-rendered
         if disable:
             self.active = False
 
@@ -314,6 +481,7 @@ class TextBox(UIElement):
         self.active = super().is_on_element(mouse_pos)
         if self.active:
             self.selected_char = max(1, len(self.content))
+            TextBox.focused = self
         if self.enable_on_click:
             self.enabled = self.active
         return was_active != self.active
@@ -362,7 +530,7 @@ class TextBox(UIElement):
             pygame.draw.rect(surf, (255,255,255), (pos[0]+cursor_x_offset, pos[1] + int(self.size[1]*1/5), self.char_size[0]//2, self.char_size[1]))
 
 class Button(UIElement):
-    BUTTON_MASK_TEXTURE = load_spritesheet("button_mask.png", tile_w=1, tile_h=1)
+    BUTTON_MASK_TEXTURE = "button_mask.png" # spritesheet of 1x1 tiles
 
     # textures is a list of textures that are drawn corresponding to the state
     # of the button, 0 -> normal, 1 -> hovered, 2 -> clicked
@@ -479,8 +647,8 @@ class Tickbox(UIElement):
         self.texture_state = 0
 
 class AngleSelector(UIElement):
-    DEFAULT_TEXTURE = load_texture("angle_setter.png")
-    ARROW_TEXTURE = load_texture("angle_arrow.png")
+    DEFAULT_TEXTURE = "angle_setter.png"
+    ARROW_TEXTURE = "angle_arrow.png"
 
     def __init__(self, pos, size, texture=None, parent=None, arrow_scale=0.6, continuous=True) -> None:
         super().__init__(pos, size, texture=texture if texture is not None else self.DEFAULT_TEXTURE, parent=parent, enabled=True)
@@ -488,7 +656,7 @@ class AngleSelector(UIElement):
         # size of the arrow scaled with the size of the widget
         self.arrow_scale = arrow_scale
         self.arrow_size = adapt_ratio((10,22), (arrow_scale*self.size[0]/25, arrow_scale*self.size[1]/25))
-        self.arrow_texture = pygame.transform.scale(self.ARROW_TEXTURE, self.arrow_size)
+        self.arrow_texture = load_texture(self.ARROW_TEXTURE, self.arrow_size)
         self.center_pos = self.get_abs_pos((self.pos[0]+self.size[0]//2, self.pos[1]+self.size[1]//2))
         # the original rect of the image has its center in the exact middle of the widget
         self.arrow_rect = self.arrow_texture.get_rect(center=self.center_pos) 
@@ -496,7 +664,7 @@ class AngleSelector(UIElement):
 
     def set_angle(self, angle: float):
         self.angle = angle
-        self.arrow_texture = pygame.transform.scale(self.ARROW_TEXTURE, self.arrow_size) # scale to the original size
+        self.arrow_texture = load_texture(self.ARROW_TEXTURE, self.arrow_size) # scale to the original size
         self.arrow_texture, _ = rotate_texture(self.arrow_texture, angle, self.center_pos) # rotate the image
         # update the rect to render it in the correct position
         self.arrow_rect = self.arrow_texture.get_rect(center=self.arrow_texture.get_rect(center=self.center_pos).center) 
@@ -548,6 +716,7 @@ class ModifiableText(UIElement):
         self.textbox = TextBox((pos[0]-int(5*dims[0]/800.0), pos[1]-int(5*dims[1]/600.0)), 
                         size, max_len, texture, parent, True, letter_width, numeric)
         self.text = ""
+        self.text_cache_used = None # the cache text_surf was rendered with, the font changes when the window is resized
         self._update_text()
         # the function that converts (text from textbox) -> base text if the second parameter is False
         # and (base text -> Textbox text) if the second parameter is True
@@ -558,8 +727,10 @@ class ModifiableText(UIElement):
         self.textbox.set_max_len(max_len)
 
     def set_text(self, text: str, update_textbox=False, disable=False) -> None:
-        self.text = text
-        self._update_text()
+        # the readouts are set every frame, only re-render the text if it actually changed
+        if text != self.text:
+            self.text = text
+            self._update_text()
         if disable:
             self.textbox.active = False
             self.textbox.enabled = False
@@ -567,7 +738,8 @@ class ModifiableText(UIElement):
             self.textbox.set_text(text)
 
     def _update_text(self) -> None:
-        self.text_surf = super().font.render(self.text, False, (255,255,255))
+        self.text_surf = self.text_cache.render(self.text)
+        self.text_cache_used = self.text_cache
     
     def on_click(self, mouse_pos):
         '''
@@ -588,6 +760,8 @@ class ModifiableText(UIElement):
 
     def render(self, surf: pygame.Surface) -> None:
         if not self.textbox.enabled:
+            if self.text_cache_used is not self.text_cache: # set_text() only renders the text again when it changes
+                self._update_text()
             surf.blit(self.text_surf, self.get_abs_pos())
         self.textbox.render(surf)
 
@@ -601,7 +775,7 @@ class TextButton(UIElement):
         self.textbox = TextBox(self.pos, self.size, max_len=len(text) if max_len is None else max_len, 
                                 texture=texture, parent=self.parent, letter_width=0.9)
         self.textbox.set_text(text)
-        self.button = Button(self.pos, self.size, textures=Button.BUTTON_MASK_TEXTURE, parent=self.parent)
+        self.button = Button(self.pos, self.size, textures=load_spritesheet(Button.BUTTON_MASK_TEXTURE, tile_w=1, tile_h=1), parent=self.parent)
 
     def on_click(self, mouse_pos):
         return self.button.on_click(mouse_pos)
@@ -618,7 +792,7 @@ class TextButton(UIElement):
             self.button.render(surf)
 
 class DropDownList(UIElement):
-    DEFAULT_ENTRY_TEXTURE = load_texture("dropdown_entry.png")
+    DEFAULT_ENTRY_TEXTURE = "dropdown_entry.png"
     
     def __init__(self, pos, size, entries=[' '], parent=None, dims=(800.0,600.0), initial_element=None) -> None:
         '''